@@ -1,11 +1,60 @@
 from django import forms
 from django.contrib import admin
-from django.contrib.admin.util import unquote
+from django.db import transaction
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 
 from ckeditor.widgets import CKEditorWidget
 
-from .models import BitGroup, PageBit, PageEdit, PageTemplate, Page
+from .managers import (
+    bit_cache_enabled,
+    deferred_invalidation,
+    invalidate_groups,
+    update_bit,
+)
+from .models import BitGroup, PageBit, PageData, PageEdit, PageTemplate, Page
+from .payload import bit_data, pack_bit, timestamp
+from .processors import render_data
+
+
+class InvalidatingAdmin(admin.ModelAdmin):
+    """
+    Admin whose views only invalidate cached content once their transaction
+    has committed, rather than as each row is saved within it
+    """
+
+    def add_view(self, request, form_url='', extra_context=None):
+        with deferred_invalidation():
+            return super(InvalidatingAdmin, self).add_view(
+                request,
+                form_url,
+                extra_context
+            )
+
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        with deferred_invalidation():
+            return super(InvalidatingAdmin, self).change_view(
+                request,
+                object_id,
+                form_url,
+                extra_context
+            )
+
+    def delete_view(self, request, object_id, extra_context=None):
+        with deferred_invalidation():
+            return super(InvalidatingAdmin, self).delete_view(
+                request,
+                object_id,
+                extra_context
+            )
+
+    def changelist_view(self, request, extra_context=None):
+        # Covers list_editable and actions such as bulk deletes
+        with deferred_invalidation():
+            return super(InvalidatingAdmin, self).changelist_view(
+                request,
+                extra_context
+            )
 
 
 class PageBitInline(admin.StackedInline):
@@ -36,7 +85,7 @@ class BitGroupAdminForm(forms.ModelForm):
         model = BitGroup
 
 
-class BitGroupAdmin(admin.ModelAdmin):
+class BitGroupAdmin(InvalidatingAdmin):
     list_display = ('name', 'slug', 'description')
     readonly_fields = ('created', 'modified')
     prepopulated_fields = {'slug': ('name',)}
@@ -58,6 +107,60 @@ class BitGroupAdmin(admin.ModelAdmin):
 admin.site.register(BitGroup, BitGroupAdmin)
 
 
+def load_bits(obj):
+    """ The bits of a group and their data, loaded once per instance """
+    bits = getattr(obj, '_page_bits', None)
+
+    if bits is None:
+        bits = obj._page_bits = list(
+            PageBit.objects.filter(group__pk=obj.pk).prefetch_related('data')
+        )
+
+    return bits
+
+
+def bit_structure(bits):
+    """ Everything about a group's bits its generated form depends on """
+    return tuple(
+        (bit.pk, bit.type, bit.name, bit.required, bit.help_text, bit.text_widget)
+        for bit in bits
+    )
+
+
+def bit_initial(bits):
+    """ Current values of a group's bits, keyed by form field name """
+    initial = {}
+
+    for bit in bits:
+        data = bit_data(bit)
+        if data is None:
+            continue
+
+        if bit.type == PageBit.IMAGE:
+            initial['bit_%s' % bit.pk] = data.image
+        else:
+            initial['bit_%s' % bit.pk] = data.data
+
+    return initial
+
+
+class PageBitsForm(forms.ModelForm):
+    """
+    Base of the generated PageEdit forms, which are shared between requests
+    so the current values of the bits are filled in per instance
+    """
+
+    def __init__(self, *args, **kwargs):
+        instance = kwargs.get('instance')
+
+        if instance is not None:
+            initial = bit_initial(load_bits(instance))
+            initial.update(kwargs.get('initial') or {})
+            kwargs['initial'] = initial
+
+        super(PageBitsForm, self).__init__(*args, **kwargs)
+
+
 class PageAdminForm(forms.ModelForm):
     """ Special form for editing a PageGroup's actual content """
     change_form_template = 'admin/pages_change_form.html'
@@ -75,8 +178,8 @@ class PageAdminForm(forms.ModelForm):
     def get_dynamic_fields(self, obj):
         fields = {}
 
-        # Add our dynamic fields
-        for bit in obj.bits.all():
+        # Add our dynamic fields, their values are filled in by PageBitsForm
+        for bit in load_bits(obj):
             bit_key = 'bit_%s' % bit.pk
 
             if bit.type == PageBit.PLAIN_TEXT:
@@ -84,7 +187,6 @@ class PageAdminForm(forms.ModelForm):
                     label=bit.name,
                     required=bit.required,
                     help_text=bit.help_text,
-                    initial=bit.data.data,
                 )
 
                 if bit.text_widget == 'textarea':
@@ -96,14 +198,12 @@ class PageAdminForm(forms.ModelForm):
                     required=bit.required,
                     help_text=bit.help_text,
                     widget=CKEditorWidget(),
-                    initial=bit.data.data,
                 )
             elif bit.type == PageBit.IMAGE:
                 field = forms.ImageField(
                     label=bit.name,
                     required=bit.required,
                     help_text=bit.help_text,
-                    initial=bit.data.image,
                 )
 
             fields[bit_key] = field
@@ -111,18 +211,27 @@ class PageAdminForm(forms.ModelForm):
         return fields
 
 
-class PageEditAdmin(admin.ModelAdmin):
+class PageEditAdmin(InvalidatingAdmin):
     """ Admin to edit BitGroup data """
     list_display = ('name', 'slug', 'description')
 
+    # Generated form classes by group pk, along with the bit structure they
+    # were built for
+    form_classes = {}
+
     class Meta:
         model = PageEdit
 
     def get_form(self, request, obj=None, **kwargs):
-        admin_form = PageAdminForm()
-        fields = admin_form.get_dynamic_fields(obj)
-        form = type('PageAdminForm', (forms.ModelForm,), fields)
-        return form
+        structure = bit_structure(load_bits(obj))
+        cached = self.form_classes.get(obj.pk)
+
+        if cached is None or cached[0] != structure:
+            fields = PageAdminForm().get_dynamic_fields(obj)
+            form = type('PageAdminForm', (PageBitsForm,), fields)
+            cached = self.form_classes[obj.pk] = (structure, form)
+
+        return cached[1]
 
     def change_view(self, request, object_id, form_url='', extra_context=None):
         template_response = super(PageEditAdmin, self).change_view(
@@ -132,27 +241,60 @@ class PageEditAdmin(admin.ModelAdmin):
             extra_context
         )
 
-        obj = self.get_object(request, unquote(object_id))
+        # Redirects after a successful save have no context
+        context = getattr(template_response, 'context_data', None)
+        obj = context and context.get('original')
 
-        if obj.instructions:
+        if obj and obj.instructions:
             safe_instructions = mark_safe(obj.instructions)
-            template_response.context_data['instructions'] = safe_instructions
+            context['instructions'] = safe_instructions
 
         return template_response
 
     def save_model(self, request, obj, form, change):
-        """ Specially handle our slightly odd saving case """
-        for key in form.cleaned_data.keys():
-            if not key.startswith('bit_'):
-                continue
-            bit, pk = key.split('_')
-
-            bit = PageBit.objects.get(pk=pk)
-            if bit.type == PageBit.PLAIN_TEXT or bit.type == PageBit.HTML:
-                bit.data.data = form.cleaned_data[key]
-            else:
-                bit.data.image = form.cleaned_data[key]
-            bit.data.save()
+        """
+        Specially handle our slightly odd saving case, only bits whose field
+        changed are written and the group is invalidated once at the end
+        """
+        changed = set(key for key in form.changed_data if key.startswith('bit_'))
+        if not changed:
+            return
+
+        now = timezone.now()
+
+        with deferred_invalidation():
+            with transaction.commit_on_success():
+                for bit in load_bits(obj):
+                    key = 'bit_%s' % bit.pk
+                    if key not in changed:
+                        continue
+
+                    data = bit_data(bit)
+
+                    if data is None or bit.type == PageBit.IMAGE:
+                        # Uploaded files, and data for bits which had none,
+                        # are stored by a regular save
+                        data = data or PageData(bit=bit)
+                        if bit.type == PageBit.IMAGE:
+                            data.image = form.cleaned_data[key]
+                        else:
+                            data.data = form.cleaned_data[key]
+                        data.save()
+                    else:
+                        data.data = form.cleaned_data[key]
+                        data.rendered = render_data(bit.type, data.data, None)
+                        data.modified = now
+                        PageData._base_manager.filter(pk=data.pk).update(
+                            data=data.data,
+                            rendered=data.rendered,
+                            modified=now,
+                        )
+
+                        if bit_cache_enabled():
+                            # Stored on its own once the transaction is over
+                            update_bit(obj.slug, bit.pk, pack_bit(bit, data), timestamp(now))
+                        else:
+                            invalidate_groups([obj.slug])
 
     def has_add_permission(self, request):
         """ Don't allow users to add new PageData items, handled by signals """
@@ -165,7 +307,7 @@ class PageEditAdmin(admin.ModelAdmin):
 admin.site.register(PageEdit, PageEditAdmin)
 
 
-class PageTemplateAdmin(admin.ModelAdmin):
+class PageTemplateAdmin(InvalidatingAdmin):
     list_display = ('name', 'path')
 
     class Meta:
@@ -174,7 +316,7 @@ class PageTemplateAdmin(admin.ModelAdmin):
 admin.site.register(PageTemplate, PageTemplateAdmin)
 
 
-class PageAdmin(admin.ModelAdmin):
+class PageAdmin(InvalidatingAdmin):
     list_display = ('name', 'url')
     filter_horizontal = ('bit_groups',)
 
@@ -0,0 +1,173 @@
+import numbers
+import pickle
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache as default_cache, get_cache
+from django.core.cache.backends.base import BaseCache
+
+# Header of compressed values, anything without it is stored as is
+COMPRESSED = 'pagebits-zlib'
+
+
+class Codec(object):
+    """
+    Compresses cache values whose pickled size reaches
+    ``PAGEBITS_COMPRESS_THRESHOLD`` bytes with zlib.
+
+    Compressed values are stored as a ``(COMPRESSED, data)`` tuple and
+    everything else unchanged, so entries written with and without
+    compression can be read side by side while it is rolled out or tuned.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def threshold(self):
+        return int(getattr(settings, 'PAGEBITS_COMPRESS_THRESHOLD', 0))
+
+    @property
+    def level(self):
+        return int(getattr(settings, 'PAGEBITS_COMPRESS_LEVEL', 6))
+
+    def encode(self, value):
+        threshold = self.threshold
+        if not threshold or value is None or isinstance(value, numbers.Number):
+            return value
+
+        start = time.time()
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) < threshold:
+            return value
+
+        compressed = zlib.compress(data, self.level)
+
+        with self._lock:
+            self.encoded += 1
+            self.bytes_in += len(data)
+            self.bytes_out += min(len(compressed), len(data))
+            self.encode_time += time.time() - start
+
+        # Data which doesn't compress is better left alone
+        if len(compressed) >= len(data):
+            return value
+
+        return (COMPRESSED, compressed)
+
+    def decode(self, value):
+        if not (isinstance(value, tuple) and len(value) == 2 and value[0] == COMPRESSED):
+            return value
+
+        start = time.time()
+        value = pickle.loads(zlib.decompress(value[1]))
+
+        with self._lock:
+            self.decoded += 1
+            self.decode_time += time.time() - start
+
+        return value
+
+    def reset(self):
+        self.encoded = 0
+        self.decoded = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.encode_time = 0.0
+        self.decode_time = 0.0
+
+    def stats(self):
+        return {
+            'encoded': self.encoded,
+            'decoded': self.decoded,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': self.bytes_out / float(self.bytes_in) if self.bytes_in else 1.0,
+            'encode_time': self.encode_time,
+            'decode_time': self.decode_time,
+        }
+
+
+class PageBitsCache(object):
+    """
+    The cache every pagebits entry goes through, values pass through the
+    codec on the way in and out.  Anything else goes to the backend as is.
+
+    Entries are kept in the ``PAGEBITS_CACHE_ALIAS`` cache, so they can be
+    given a backend of their own rather than compete with sessions and the
+    rest of the site for memory, and are written with ``PAGEBITS_CACHE_VERSION``
+    when set, so changing it drops every pagebits entry at once.
+    """
+
+    def __init__(self, codec):
+        self.codec = codec
+        self._backends = {}
+
+    @property
+    def backend(self):
+        alias = getattr(settings, 'PAGEBITS_CACHE_ALIAS', DEFAULT_CACHE_ALIAS)
+        if alias == DEFAULT_CACHE_ALIAS:
+            return default_cache
+
+        if alias not in self._backends:
+            self._backends[alias] = get_cache(alias)
+
+        return self._backends[alias]
+
+    @property
+    def version(self):
+        return getattr(settings, 'PAGEBITS_CACHE_VERSION', None)
+
+    def get(self, key, default=None):
+        return self.codec.decode(self.backend.get(key, default, version=self.version))
+
+    def get_many(self, keys):
+        decode = self.codec.decode
+        found = self.backend.get_many(keys, version=self.version)
+        return dict((key, decode(value)) for key, value in found.items())
+
+    def set(self, key, value, timeout=None):
+        self.backend.set(key, self.codec.encode(value), timeout, version=self.version)
+
+    def set_many(self, data, timeout=None):
+        encode = self.codec.encode
+        self.backend.set_many(
+            dict((key, encode(value)) for key, value in data.items()),
+            timeout,
+            version=self.version,
+        )
+
+    def add(self, key, value, timeout=None):
+        return self.backend.add(key, self.codec.encode(value), timeout, version=self.version)
+
+    def delete(self, key):
+        self.backend.delete(key, version=self.version)
+
+    def delete_many(self, keys):
+        self.backend.delete_many(keys, version=self.version)
+
+    def incr(self, key, delta=1, timeout=None):
+        """
+        Backends without an incr() of their own emulate it with a set() at
+        the default timeout, pass ``timeout`` to keep the key's lifetime
+        """
+        backend = self.backend
+        if timeout is None or type(backend).incr != BaseCache.incr:
+            return backend.incr(key, delta, version=self.version)
+
+        value = backend.get(key, version=self.version)
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+
+        backend.set(key, value + delta, timeout, version=self.version)
+        return value + delta
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+codec = Codec()
+cache = PageBitsCache(codec)
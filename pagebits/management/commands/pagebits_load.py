@@ -0,0 +1,52 @@
+import json
+import os
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import BitGroup
+
+
+def read_spec(path):
+    """ Parse a JSON or, with PyYAML installed, YAML provisioning spec """
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise CommandError("PyYAML is needed to load %s" % path)
+            return yaml.safe_load(f)
+
+        return json.load(f)
+
+
+class Command(BaseCommand):
+    help = "Create BitGroups, PageBits and their data from JSON or YAML specs"
+    args = "<spec spec ...>"
+
+    def handle(self, *paths, **options):
+        if not paths:
+            raise CommandError("Give at least one spec file to load")
+
+        verbosity = int(options.get('verbosity', 1))
+        start = time.time()
+
+        groups = []
+        for path in paths:
+            spec = read_spec(path)
+            if isinstance(spec, dict):
+                spec = spec.get('groups', [])
+            groups.extend(spec)
+
+        try:
+            created_groups, created_bits = BitGroup.objects.bulk_provision(groups)
+        except ValidationError as e:
+            raise CommandError("\n".join(e.messages))
+
+        if verbosity:
+            self.stdout.write(
+                "Created %d groups and %d bits in %.2fs\n" % (
+                    created_groups, created_bits, time.time() - start,
+                )
+            )
@@ -0,0 +1,40 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...managers import clock_version
+from ...models import BitGroup, Page
+from ...payload import pack_group
+from ...snapshot import write_snapshot
+
+
+class Command(BaseCommand):
+    help = "Write every BitGroup and the Page routing table to a snapshot file"
+    args = "<path>"
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the path of the snapshot file to write")
+
+        path = args[0]
+        verbosity = int(options.get('verbosity', 1))
+        start = time.time()
+
+        groups = BitGroup.objects.prefetch_related('bits__data')
+        payloads = dict((group.slug, pack_group(group)) for group in groups)
+        routes = Page.objects._load_routes()
+
+        # Write next to the target and rename over it, so processes which
+        # have the old file mapped keep reading a complete one
+        tmp_path = '%s.tmp' % path
+        with open(tmp_path, 'wb') as f:
+            write_snapshot(f, payloads, routes, clock_version())
+        os.rename(tmp_path, path)
+
+        if verbosity:
+            self.stdout.write(
+                "Wrote %d groups and %d page routes to %s in %.2fs\n" % (
+                    len(payloads), len(routes), path, time.time() - start,
+                )
+            )
@@ -0,0 +1,77 @@
+import time
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ...cache import cache
+from ...managers import entry_timeout
+from ...models import BitGroup, Page
+
+
+class Command(BaseCommand):
+    help = "Load BitGroups and the Page routing table into the cache"
+    args = "[slug slug ...]"
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--batch-size',
+            type='int',
+            dest='batch_size',
+            default=100,
+            help='Number of groups loaded per query (default 100)',
+        ),
+        make_option(
+            '--workers',
+            type='int',
+            dest='workers',
+            default=4,
+            help='Number of threads writing to the cache (default 4)',
+        ),
+        make_option(
+            '--no-routes',
+            action='store_false',
+            dest='routes',
+            default=True,
+            help="Don't warm the Page routing table",
+        ),
+    )
+
+    def handle(self, *slugs, **options):
+        batch_size = max(options['batch_size'], 1)
+        verbosity = int(options.get('verbosity', 1))
+
+        groups = BitGroup.objects.order_by('slug')
+        if slugs:
+            groups = groups.filter(slug__in=slugs)
+        slugs = list(groups.values_list('slug', flat=True))
+
+        start = time.time()
+        pool = ThreadPool(max(options['workers'], 1))
+        writes = []
+        warmed = 0
+
+        try:
+            # Queries run here, one batch at a time, while the pool writes
+            # earlier batches to the cache
+            for offset in range(0, len(slugs), batch_size):
+                entries = BitGroup.objects.warm_entries(slugs[offset:offset + batch_size])
+                writes.append(pool.apply_async(cache.set_many, (entries, entry_timeout())))
+                warmed += len(entries)
+
+            for write in writes:
+                write.get()
+        finally:
+            pool.close()
+            pool.join()
+
+        routes = 0
+        if options['routes']:
+            routes = len(Page.objects.get_routes())
+
+        if verbosity:
+            self.stdout.write(
+                "Warmed %d groups in %d batches and %d page routes in %.2fs\n" % (
+                    warmed, len(writes), routes, time.time() - start,
+                )
+            )
@@ -1,24 +1,1063 @@
-from django.db import models
-from django.core.cache import cache
+import math
+import pickle
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.db import connection, models, transaction
+from django.core.exceptions import ValidationError
+from django.core.signals import request_started
 from django.conf import settings
+from django.template.defaultfilters import slugify
+from django.utils import timezone
+
+from .cache import cache
+from .payload import PAYLOAD_VERSION, pack_group, unpack_group
+from .processors import render_data
+from .snapshot import snapshots
+from .utils import (
+    bit_cache_key,
+    bitgroup_cache_key,
+    bitgroup_version_key,
+    cache_timeout,
+    generation_cache_key,
+    manifest_cache_key,
+    routes_cache_key,
+    routes_version_key,
+)
+
+
+def clock_version():
+    """
+    Starting value for version and generation keys, seeded from the clock so
+    a key which was evicted never restarts at a value already handed out
+    """
+    return int(time.time() * 1000)
+
+
+class LocalCache(object):
+    """
+    Optional per-process LRU of group payloads which sits in front of the
+    shared cache.
+
+    Entries are stored along with the global content generation current at
+    the time, and are only used while that generation is still current.  The
+    generation is read from the shared cache at most once per request, or
+    once every ``PAGEBITS_LOCAL_CACHE_INTERVAL`` seconds when that is set, so
+    every worker notices edits quickly without a round-trip per group.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = None
+        self._generation_key = None
+        self._expired = True
+        self._checked = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_entries(self):
+        return int(getattr(settings, 'PAGEBITS_LOCAL_CACHE_ENTRIES', 0))
+
+    @property
+    def max_bytes(self):
+        return int(getattr(settings, 'PAGEBITS_LOCAL_CACHE_BYTES', 0))
+
+    @property
+    def enabled(self):
+        return bool(self.max_entries or self.max_bytes)
+
+    def generation(self):
+        """ Return the global content generation, re-reading it when due """
+        interval = getattr(settings, 'PAGEBITS_LOCAL_CACHE_INTERVAL', 0)
+        now = time.time()
+
+        # A cache key function may give each site a generation of its own
+        key = generation_cache_key()
+
+        if (self._expired or key != self._generation_key or
+                (interval and now - self._checked >= interval)):
+            generation = cache.get(key)
+
+            if generation is None:
+                generation = clock_version()
+                if not cache.add(key, generation, version_timeout()):
+                    generation = cache.get(key, generation)
+
+            # Entries are only good for the generation, of the same site,
+            # they were stored under
+            if generation != self._generation or key != self._generation_key:
+                self.clear()
+
+            self._generation = generation
+            self._generation_key = key
+            self._expired = False
+            self._checked = now
+
+        return self._generation
+
+    def bump(self):
+        """ Move to a new content generation, dropping every local entry """
+        try:
+            cache.incr(generation_cache_key(), timeout=version_timeout())
+        except ValueError:
+            cache.set(generation_cache_key(), clock_version(), version_timeout())
+
+        self.expire()
+
+    def expire(self):
+        """ Force the generation to be re-read on the next lookup """
+        self._expired = True
+
+    def get(self, key):
+        generation = self.generation()
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None or entry[0] != generation:
+                if entry is not None:
+                    self._bytes -= entry[2]
+                self.misses += 1
+                return None
+
+            # Re-insert to mark the entry as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        generation = self.generation()
+        max_entries = self.max_entries
+        max_bytes = self.max_bytes
+
+        size = 0
+        if max_bytes:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+            if size > max_bytes:
+                return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+            self._entries[key] = (generation, value, size)
+            self._bytes += size
+
+            while self._entries and (
+                (max_entries and len(self._entries) > max_entries) or
+                (max_bytes and self._bytes > max_bytes)
+            ):
+                evicted = self._entries.popitem(last=False)[1]
+                self._bytes -= evicted[2]
+                self.evictions += 1
+
+    def full(self):
+        """ Whether adding another entry would evict one """
+        max_entries = self.max_entries
+        max_bytes = self.max_bytes
+
+        return bool(
+            (max_entries and len(self._entries) >= max_entries) or
+            (max_bytes and self._bytes >= max_bytes)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+local_cache = LocalCache()
+
+
+def expire_generation(sender, **kwargs):
+    """ Re-check the content generation once per request by default """
+    if not getattr(settings, 'PAGEBITS_LOCAL_CACHE_INTERVAL', 0):
+        local_cache.expire()
+
+request_started.connect(expire_generation)
+
+
+class RequestStore(threading.local):
+    """
+    Groups already loaded during the current request, so every view, tag
+    and include asking for the same group shares a single lookup.  Only
+    active between begin() and end(), see PageBitsMiddleware.
+    """
+    groups = None
+
+    def begin(self):
+        self.groups = {}
+
+    def end(self):
+        self.groups = None
+
+    def discard(self, slugs):
+        if self.groups:
+            for slug in slugs:
+                self.groups.pop(slug, None)
+
+
+request_store = RequestStore()
+
+
+def reset_request_store(sender, **kwargs):
+    """ Never let groups memoized by one request leak into the next """
+    request_store.end()
+
+request_started.connect(reset_request_store)
+
+
+def get_versions(slugs):
+    """ Return the current cache version of each BitGroup slug """
+    keys = dict((slug, bitgroup_version_key(slug)) for slug in slugs)
+    found = cache.get_many(list(keys.values()))
+
+    versions = {}
+    for slug, key in keys.items():
+        version = found.get(key)
+
+        if version is None:
+            version = clock_version()
+            if not cache.add(key, version, version_timeout()):
+                version = cache.get(key, version)
+
+        versions[slug] = version
+
+    return versions
+
+
+def invalidate_groups(slugs):
+    """
+    Bump the version of each BitGroup slug, so readers move on to a new
+    cache key instead of relying on a delete winning any race
+    """
+    slugs = set(slugs)
+
+    if deferred.slugs is not None:
+        deferred.slugs.update(slugs)
+        return
+
+    for slug in slugs:
+        bump_version(slug)
+
+    if slugs:
+        local_cache.bump()
+        request_store.discard(slugs)
+
+
+class DeferredInvalidation(threading.local):
+    """
+    Groups, edited bits and whether the routing table were invalidated so
+    far within deferred_invalidation()
+    """
+    slugs = None
+    bits = None
+    routes = False
+
+
+deferred = DeferredInvalidation()
+
+
+@contextmanager
+def deferred_invalidation():
+    """
+    Collect the groups invalidated within the block and only bump each of
+    them once, when the outermost block ends.
+
+    Wrapped around a transaction, the bumps happen once it has committed,
+    so no reader can cache rows from before the change under the new
+    version.  Invalidation otherwise happens as rows are saved, within
+    whatever transaction the caller has open.
+    """
+    if deferred.slugs is not None:
+        yield
+        return
+
+    deferred.slugs = set()
+    deferred.bits = []
+    deferred.routes = False
+    try:
+        yield
+    finally:
+        slugs, deferred.slugs = deferred.slugs, None
+        bits, deferred.bits = deferred.bits, None
+
+        # Edited bits are stored on their own, all of a group's under one
+        # new version, unless the whole group is being reloaded anyway
+        edited = {}
+        for slug, bit_id, bit, modified in bits:
+            if slug not in slugs:
+                group_bits, latest = edited.get(slug, ({}, modified))
+                group_bits[bit_id] = bit
+                edited[slug] = (group_bits, max(latest, modified))
+
+        for slug, (group_bits, modified) in edited.items():
+            update_bits(slug, group_bits, modified)
+
+        invalidate_groups(slugs)
+
+        if deferred.routes:
+            deferred.routes = False
+            invalidate_routes()
+
+
+def bump_version(slug):
+    """ Move a group on to a new version, returned unless it had none yet """
+    key = bitgroup_version_key(slug)
+    try:
+        return cache.incr(key, timeout=version_timeout())
+    except ValueError:
+        cache.set(key, clock_version(), version_timeout())
+
+
+def bit_cache_enabled():
+    return bool(getattr(settings, 'PAGEBITS_BIT_CACHE', False))
+
+
+def update_bit(slug, bit_id, bit, modified):
+    """
+    Store an edited bit under a key of its own and move its group on to a
+    new version whose manifest points at it, so the group is put back
+    together from the cache instead of being reloaded from the database.
+    Within deferred_invalidation() all of a group's bits share one version.
+    """
+    if deferred.slugs is not None:
+        deferred.bits.append((slug, bit_id, bit, modified))
+        return
+
+    update_bits(slug, {bit_id: bit}, modified)
+
+
+def update_bits(slug, bits, modified):
+    """
+    Store a group's edited bits, a dict of packed bits by id, under a single
+    new version of the group.
+
+    When the old manifest is gone, or someone else changed the group at the
+    same time, the new version simply has no manifest and is reloaded.
+    """
+    version = cache.get(bitgroup_version_key(slug))
+    manifest = None
+    if version is not None:
+        manifest = cache.get(manifest_cache_key(slug, version))
+
+    bit_version = clock_version()
+    if manifest is not None:
+        cache.set_many(
+            dict((bit_cache_key(bit_id, bit_version), bit) for bit_id, bit in bits.items()),
+            entry_timeout(),
+        )
+
+    new_version = bump_version(slug)
+    local_cache.bump()
+    request_store.discard([slug])
+
+    if manifest is None or new_version != version + 1:
+        return
+
+    old_modified, entries = manifest
+    if not set(bits) <= set(entry[1] for entry in entries):
+        return
+
+    entries = [
+        (name, entry_id, bit_version if entry_id in bits else entry_version)
+        for name, entry_id, entry_version in entries
+    ]
+    cache.set(
+        manifest_cache_key(slug, new_version),
+        (max(old_modified, modified), entries),
+        entry_timeout(),
+    )
+
+
+def stale_ttl():
+    return int(getattr(settings, 'PAGEBITS_STALE_TTL', 0))
+
+
+def entry_timeout():
+    """
+    How long entries live in the cache, past their expiry they may still be
+    served for up to ``PAGEBITS_STALE_TTL`` seconds while being refreshed
+    """
+    return cache_timeout() + stale_ttl()
+
+
+# Version, generation and routes version keys outlive the entries they
+# point at by far, so entries are refreshed or served stale under the same
+# version rather than lost along with it.  Django doesn't have a portable
+# "never expire" timeout before 1.6.
+VERSION_TIMEOUT = 30 * 24 * 3600
+
+
+def version_timeout():
+    return max(VERSION_TIMEOUT, entry_timeout() * 10)
+
+
+# Payload cached for slugs without a BitGroup, so asking for one doesn't
+# cost a query every time.  It lives under the versioned key like any other
+# entry, so creating the group moves readers on from it.
+MISSING = 'pagebits-missing'
+
+
+def wrap_entry(payload, delta):
+    """
+    Cache entry for a payload, along with when it expires and how many
+    seconds it took to build
+    """
+    return (payload, time.time() + cache_timeout(), delta)
+
+
+def unwrap_entry(entry):
+    """ Return the (payload, expires, delta) of a cache entry """
+    if isinstance(entry, tuple) and len(entry) == 3:
+        return entry
+
+    return None, None, None
+
+
+def refresh_early(expires, delta):
+    """
+    Probabilistic early expiration, the closer an entry is to expiring and
+    the longer it took to build the more likely it is to be rebuilt now.
+    ``PAGEBITS_EARLY_REFRESH_BETA`` scales how eager this is, 0 disables it.
+    """
+    beta = float(getattr(settings, 'PAGEBITS_EARLY_REFRESH_BETA', 1.0))
+
+    if not beta or expires is None:
+        return False
+
+    return time.time() - delta * beta * math.log(1.0 - random.random()) >= expires
+
+
+def lock_key(key):
+    return '%s:lock' % key
+
+
+def acquire_lock(key):
+    """ Try to become the single process rebuilding a cache entry """
+    timeout = int(getattr(settings, 'PAGEBITS_LOCK_TIMEOUT', 10))
+    return cache.add(lock_key(key), 1, timeout)
+
+
+def release_locks(keys):
+    cache.delete_many([lock_key(key) for key in keys])
+
+
+class RefreshPool(object):
+    """
+    Bounded set of background threads used to refresh stale groups, at most
+    ``PAGEBITS_STALE_WORKERS`` run at once and extra work is turned away
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = None
+        self._threads = []
+
+    def submit(self, func, *args):
+        """ Run func in the background, returns False when no slot is free """
+        with self._lock:
+            if self._slots is None:
+                workers = int(getattr(settings, 'PAGEBITS_STALE_WORKERS', 2))
+                self._slots = threading.BoundedSemaphore(workers)
+
+            self._threads = [t for t in self._threads if t.is_alive()]
+
+        if not self._slots.acquire(False):
+            return False
+
+        def run():
+            try:
+                func(*args)
+            finally:
+                # Threads get their own database connection, don't leak it
+                connection.close()
+                self._slots.release()
 
-from .utils import bitgroup_cache_key
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+        with self._lock:
+            self._threads.append(thread)
+
+        return True
+
+    def join(self, timeout=None):
+        """ Wait for running refreshes, mostly useful in tests """
+        with self._lock:
+            threads = list(self._threads)
+
+        for thread in threads:
+            thread.join(timeout)
+
+
+refresh_pool = RefreshPool()
+
+
+class InvalidatingQuerySet(models.query.QuerySet):
+    """
+    QuerySet which invalidates every BitGroup touched by a bulk ``update()``,
+    deletes are covered by the post_delete receivers
+    """
+    # Lookup from this model to the slug of its BitGroup
+    group_slug_lookup = None
+
+    def update(self, **kwargs):
+        rows = list(self.values_list('pk', self.group_slug_lookup))
+        pks = [pk for pk, slug in rows]
+        slugs = set(slug for pk, slug in rows)
+
+        updated = super(InvalidatingQuerySet, self).update(**kwargs)
+
+        # Catch groups (or slugs) the rows were moved to
+        slugs.update(self.model._default_manager.filter(
+            pk__in=pks,
+        ).values_list(self.group_slug_lookup, flat=True))
+
+        invalidate_groups(slugs)
+        return updated
+
+
+class BitGroupQuerySet(InvalidatingQuerySet):
+    group_slug_lookup = 'slug'
+
+
+class PageBitQuerySet(InvalidatingQuerySet):
+    group_slug_lookup = 'group__slug'
+
+
+class PageDataQuerySet(InvalidatingQuerySet):
+    group_slug_lookup = 'bit__group__slug'
+
+
+class PageBitManager(models.Manager):
+
+    def get_query_set(self):
+        return PageBitQuerySet(self.model, using=self._db)
+
+
+class PageDataManager(models.Manager):
+
+    def get_query_set(self):
+        return PageDataQuerySet(self.model, using=self._db)
 
 
 class BitGroupManager(models.Manager):
 
+    def get_query_set(self):
+        return BitGroupQuerySet(self.model, using=self._db)
+
     def get_group(self, slug):
-        """ Retrieve a group by slug, with caching """
-        key = bitgroup_cache_key(slug)
-        cached_group = cache.get(key)
+        """
+        Retrieve the bits of a group by slug, with caching, as a dict of
+        resolved values keyed by context name
+        """
+        groups = self.get_groups([slug])
+
+        if not groups:
+            raise self.model.DoesNotExist(
+                "%s matching query does not exist." % self.model._meta.object_name
+            )
+
+        return groups[0]
+
+    def get_groups(self, slugs):
+        """
+        Retrieve the bits of several groups by slug, with caching.
+
+        Groups found in the local cache are used as is.  For the rest, their
+        versions and then their versioned keys are each fetched with a single
+        ``get_many`` and all of the misses are loaded with one query plus the
+        bits prefetch.  Groups are returned in the order their slugs were
+        given, slugs which do not match a group are skipped.
+
+        Only one process rebuilds a missing entry at a time, the others wait
+        briefly for it to show up, and entries close to expiring are rebuilt
+        early by a single request while everybody else keeps using them.
+        With ``PAGEBITS_STALE_TTL`` set that rebuild happens in a background
+        thread and expired entries are served for that many extra seconds.
+
+        While a request store is active every group is looked up at most
+        once per request.  With ``PAGEBITS_SNAPSHOT`` set groups are read
+        from the snapshot file instead, without any cache or database access.
+        """
+        memo = request_store.groups
+        if memo is not None:
+            missing = [slug for slug in slugs if slug not in memo]
+            if missing:
+                # Slugs without a group are remembered as None
+                memo.update(dict.fromkeys(missing))
+                for bits in self._get_groups(missing):
+                    memo[bits.slug] = bits
+            return [memo[slug] for slug in slugs if memo[slug] is not None]
+
+        return self._get_groups(slugs)
+
+    def _get_groups(self, slugs):
+        snapshot = snapshots.get()
+        if snapshot is not None:
+            return snapshot.get_groups(slugs)
+
+        use_local = local_cache.enabled
+
+        groups = {}
+        missing = set()
+        if use_local:
+            for slug in set(slugs):
+                # Keyed like the shared cache, so a cache key function
+                # keeps the entries of each site apart here as well
+                version, payload = local_cache.get(bitgroup_cache_key(slug)) or (None, None)
+                if payload == MISSING:
+                    missing.add(slug)
+                    continue
+
+                data = unpack_group(payload, slug, version)
+                if data is not None:
+                    groups[slug] = data
+
+        remaining = set(slug for slug in slugs if slug not in groups and slug not in missing)
+        if not remaining:
+            return [groups[slug] for slug in slugs if slug in groups]
+
+        versions = get_versions(remaining)
+        keys = dict(
+            (slug, bitgroup_cache_key(slug, versions[slug]))
+            for slug in remaining
+        )
+        cached = cache.get_many(list(keys.values()))
+
+        refresh = []
+        for slug, key in keys.items():
+            payload, expires, delta = unwrap_entry(cached.get(key))
+
+            if payload == MISSING:
+                missing.add(slug)
+            else:
+                data = unpack_group(payload, slug, versions[slug])
+                if data is None:
+                    continue
+                groups[slug] = data
+
+            if use_local:
+                local_cache.set(bitgroup_cache_key(slug), (versions[slug], payload))
+            if refresh_early(expires, delta):
+                refresh.append(slug)
+
+        # Early refreshes are simply skipped when someone else holds the
+        # lock, the value we have is still good
+        refresh = [slug for slug in refresh if acquire_lock(keys[slug])]
+
+        if refresh and stale_ttl():
+            # Serve what we have and refresh in the background
+            if not refresh_pool.submit(self._build_entries, refresh, keys, True, versions):
+                release_locks([keys[slug] for slug in refresh])
+            refresh = []
+
+        load = refresh
+        waiting = {}
+
+        for slug in remaining:
+            if slug in groups or slug in missing:
+                continue
+            if acquire_lock(keys[slug]):
+                load.append(slug)
+            else:
+                waiting[slug] = keys[slug]
+
+        payloads = {}
+        if load:
+            payloads.update(self._build_entries(load, keys, True, versions))
+
+        if waiting:
+            found = self._wait_for_entries(waiting)
+            payloads.update(found)
+
+            # Give up on a lock holder which is too slow or has gone away
+            late = [slug for slug in waiting if slug not in found]
+            if late:
+                payloads.update(self._build_entries(late, keys, False, versions))
+
+        for slug, payload in payloads.items():
+            if payload == MISSING:
+                continue
+            groups[slug] = unpack_group(payload, slug, versions[slug])
+            if use_local:
+                local_cache.set(bitgroup_cache_key(slug), (versions[slug], payload))
+
+        return [groups[slug] for slug in slugs if slug in groups]
+
+    def _load_groups(self, slugs):
+        return self.get_query_set().filter(
+            slug__in=slugs,
+        ).prefetch_related('bits__data')
+
+    def _load_payloads(self, slugs):
+        """ Build the cache payloads of the given slugs from the database """
+        return dict(
+            (group.slug, pack_group(group)) for group in self._load_groups(slugs)
+        )
+
+    def _assemble_payloads(self, slugs, versions):
+        """
+        Build the cache payloads of the given slugs from their manifests and
+        individually cached bits, falling back on the database for groups
+        which have no manifest yet or miss some of their bits.  Groups read
+        from the database have their bits and manifest stored for next time.
+        """
+        manifest_keys = dict(
+            (slug, manifest_cache_key(slug, versions[slug])) for slug in slugs
+        )
+        found = cache.get_many(list(manifest_keys.values()))
+        manifests = dict(
+            (slug, found[key]) for slug, key in manifest_keys.items() if key in found
+        )
+
+        bits = cache.get_many([
+            bit_cache_key(bit_id, version)
+            for modified, entries in manifests.values()
+            for name, bit_id, version in entries
+        ])
+
+        payloads = {}
+        for slug, (modified, entries) in manifests.items():
+            keys = [bit_cache_key(bit_id, version) for name, bit_id, version in entries]
+            if all(key in bits for key in keys):
+                payloads[slug] = (PAYLOAD_VERSION, [bits[key] for key in keys], modified)
+
+        missing = [slug for slug in slugs if slug not in payloads]
+        if not missing:
+            return payloads
+
+        bit_version = clock_version()
+        new_bits = {}
+        for group in self._load_groups(missing):
+            payload = pack_group(group)
+            ids = [bit.pk for bit in group.bits.all()]
+
+            for bit_id, bit in zip(ids, payload[1]):
+                new_bits[bit_cache_key(bit_id, bit_version)] = bit
+
+            # Edits write their manifest over this one, never the reverse
+            cache.add(manifest_cache_key(group.slug, versions[group.slug]), (
+                payload[2],
+                [(bit[0], bit_id, bit_version) for bit_id, bit in zip(ids, payload[1])],
+            ), entry_timeout())
+            payloads[group.slug] = payload
+
+        if new_bits:
+            cache.set_many(new_bits, entry_timeout())
+
+        return payloads
+
+    def _fetch_payloads(self, slugs, versions=None):
+        if versions is not None and bit_cache_enabled():
+            return self._assemble_payloads(slugs, versions)
+
+        return self._load_payloads(slugs)
+
+    def warm_entries(self, slugs):
+        """
+        Load groups as cache entries keyed by their current versioned keys,
+        ready to be stored with ``set_many`` ahead of any request for them
+        """
+        versions = get_versions(slugs)
+
+        start = time.time()
+        payloads = self._fetch_payloads(slugs, versions)
+        delta = time.time() - start
+
+        return dict(
+            (bitgroup_cache_key(slug, versions[slug]), wrap_entry(payload, delta))
+            for slug, payload in payloads.items()
+        )
+
+    def _build_entries(self, slugs, keys, locked=False, versions=None):
+        """
+        Load slugs from the database and store them in the cache, slugs
+        without a group are stored as MISSING
+        """
+        try:
+            start = time.time()
+            payloads = self._fetch_payloads(slugs, versions)
+            delta = time.time() - start
+
+            if slugs:
+                cache.set_many(dict(
+                    (keys[slug], wrap_entry(payloads.get(slug, MISSING), delta))
+                    for slug in slugs
+                ), entry_timeout())
+        finally:
+            if locked:
+                release_locks([keys[slug] for slug in slugs])
+
+        return payloads
+
+    def _wait_for_entries(self, keys):
+        """
+        Poll for entries which another process is busy building, until they
+        show up or that process releases its lock without storing them
+        """
+        deadline = time.time() + float(getattr(settings, 'PAGEBITS_LOCK_WAIT', 0.5))
+        pending = dict(keys)
+        found = {}
+
+        while pending and time.time() < deadline:
+            time.sleep(0.05)
+            locks = dict((slug, lock_key(key)) for slug, key in pending.items())
+            cached = cache.get_many(list(pending.values()) + list(locks.values()))
+
+            for slug, key in list(pending.items()):
+                payload = unwrap_entry(cached.get(key))[0]
+                if payload == MISSING or unpack_group(payload) is not None:
+                    found[slug] = payload
+                    del pending[slug]
+                elif locks[slug] not in cached:
+                    del pending[slug]
+
+        return found
+
+    def bulk_provision(self, spec):
+        """
+        Create groups, their bits and their data from a declarative spec,
+        with a handful of bulk queries in one transaction and a single cache
+        invalidation at the end, instead of validating and signalling row by
+        row::
+
+            [{'name': 'Homepage', 'slug': 'homepage', 'bits': [
+                {'name': 'Header', 'context_name': 'header', 'type': 'html',
+                 'data': '<h1>Welcome</h1>'},
+            ]}]
+
+        The spec may also be a dict with a ``groups`` list.  Bit types are
+        given by number or name, and groups whose slug already exists have
+        the bits added to them.  The whole spec is checked first and a
+        ValidationError lists every problem without anything being written.
+
+        Returns the number of groups and bits created.
+        """
+        PageBit = models.get_model('pagebits', 'PageBit')
+        PageData = models.get_model('pagebits', 'PageData')
+
+        types = dict(
+            (label.lower().replace(' ', '_'), value)
+            for value, label in PageBit.BIT_TYPE_CHOICES
+        )
+        types.update((value, value) for value, label in PageBit.BIT_TYPE_CHOICES)
+        widgets = [value for value, label in PageBit.TEXT_WIDGET_CHOICES]
+
+        if isinstance(spec, dict):
+            spec = spec.get('groups', [])
+
+        groups = []
+        errors = []
+
+        for group in spec:
+            group = dict(group)
+            if not group.get('name'):
+                errors.append("Every group needs a name")
+                continue
+
+            group['slug'] = group.get('slug') or slugify(group['name'])
+            if group['slug'] in [g['slug'] for g in groups]:
+                errors.append("Group '%s' is given more than once" % group['slug'])
+            groups.append(group)
+
+        existing = dict(
+            self.filter(slug__in=[g['slug'] for g in groups]).values_list('slug', 'pk')
+        )
+        used = set()
+        if existing:
+            used.update(PageBit.objects.filter(
+                group__slug__in=list(existing),
+            ).values_list('group__slug', 'context_name'))
+
+        for group in groups:
+            for bit in group.get('bits', []):
+                name = (group['slug'], bit.get('context_name'))
+
+                if not bit.get('name') or not bit.get('context_name'):
+                    errors.append("Bits in '%s' need a name and context_name" % group['slug'])
+                elif name in used:
+                    errors.append("The name '%s' is already used in PageGroup '%s'" % name[::-1])
+                if bit.get('type', 0) not in types:
+                    errors.append("Unknown bit type '%s' in '%s'" % (bit.get('type'), group['slug']))
+                if bit.get('text_widget', PageBit.WIDGET_CHARFIELD) not in widgets:
+                    errors.append("Unknown text widget '%s' in '%s'" % (bit['text_widget'], group['slug']))
+
+                used.add(name)
+
+        if errors:
+            raise ValidationError(errors)
+
+        now = timezone.now()
+        new_groups = [group for group in groups if group['slug'] not in existing]
+        new_bits = [
+            (group['slug'], bit) for group in groups for bit in group.get('bits', [])
+        ]
+
+        with transaction.commit_on_success():
+            self.bulk_create([
+                self.model(
+                    name=group['name'],
+                    slug=group['slug'],
+                    description=group.get('description', ''),
+                    instructions=group.get('instructions', ''),
+                    created=now,
+                    modified=now,
+                )
+                for group in new_groups
+            ])
+
+            # bulk_create() doesn't hand back primary keys, so read them
+            group_ids = dict(existing)
+            group_ids.update(self.filter(
+                slug__in=[group['slug'] for group in new_groups],
+            ).values_list('slug', 'pk'))
+
+            PageBit.objects.bulk_create([
+                PageBit(
+                    group_id=group_ids[slug],
+                    name=bit['name'],
+                    context_name=bit['context_name'],
+                    type=types[bit.get('type', 0)],
+                    order=bit.get('order', 1),
+                    text_widget=bit.get('text_widget', PageBit.WIDGET_CHARFIELD),
+                    required=bit.get('required', False),
+                    help_text=bit.get('help_text', ''),
+                    created=now,
+                    modified=now,
+                )
+                for slug, bit in new_bits
+            ])
+
+            bit_ids = dict(
+                ((group_id, context_name), pk)
+                for pk, group_id, context_name in PageBit.objects.filter(
+                    group__pk__in=list(group_ids.values()),
+                ).values_list('pk', 'group', 'context_name')
+            )
+
+            page_data = []
+            for slug, bit in new_bits:
+                data = PageData(
+                    bit_id=bit_ids[(group_ids[slug], bit['context_name'])],
+                    data=bit.get('data', ''),
+                    image=bit.get('image', ''),
+                    created=now,
+                    modified=now,
+                )
+                data.rendered = render_data(types[bit.get('type', 0)], data.data, data.image)
+                page_data.append(data)
+
+            PageData.objects.bulk_create(page_data)
+
+        invalidate_groups(group_ids)
+
+        return len(new_groups), len(new_bits)
+
+
+def invalidate_routes():
+    """ Bump the version of the Page routing table """
+    if deferred.slugs is not None:
+        deferred.routes = True
+        return
+
+    try:
+        cache.incr(routes_version_key(), timeout=version_timeout())
+    except ValueError:
+        cache.set(routes_version_key(), clock_version(), version_timeout())
+
+    local_cache.bump()
+
+
+class RoutingQuerySet(models.query.QuerySet):
+    """ QuerySet which invalidates the Page routing table on bulk updates """
+
+    def update(self, **kwargs):
+        updated = super(RoutingQuerySet, self).update(**kwargs)
+        invalidate_routes()
+        return updated
+
+
+class PageTemplateManager(models.Manager):
+
+    def get_query_set(self):
+        return RoutingQuerySet(self.model, using=self._db)
+
+
+class PageManager(models.Manager):
+    """
+    Keeps a table of every Page url and the template path and group slugs
+    it needs, in the shared cache and in process memory.  A url lookup never
+    touches the database, for existing pages or for unknown urls.
+    """
+    _routes = None
+
+    def get_query_set(self):
+        return RoutingQuerySet(self.model, using=self._db)
+
+    def get_route(self, url):
+        """ Return (template path, group slugs) for a url, or None """
+        return self.get_routes().get(url)
+
+    def get_routes(self):
+        snapshot = snapshots.get()
+        if snapshot is not None:
+            return snapshot.routes
+
+        # The process copy is good for as long as the content generation,
+        # which is checked at most once per request, doesn't change.  The
+        # version key tells apart sites separated by a cache key function.
+        current = (routes_version_key(), local_cache.generation())
+
+        if self._routes is None or self._routes[0] != current:
+            key = routes_cache_key(self._routes_version())
+            routes = cache.get(key)
+
+            if routes is None:
+                routes = self._load_routes()
+                cache.set(key, routes, cache_timeout())
+
+            PageManager._routes = (current, routes)
+
+        return self._routes[1]
+
+    def _routes_version(self):
+        version = cache.get(routes_version_key())
+
+        if version is None:
+            version = clock_version()
+            if not cache.add(routes_version_key(), version, version_timeout()):
+                version = cache.get(routes_version_key(), version)
 
-        if not cached_group:
-            cached_group = self.get_query_set().select_related(
-                'bits',
-            ).prefetch_related('bits__data').get(slug=slug)
+        return version
 
-            timeout = getattr(settings, 'PAGEBITS_CACHE_TIMEOUT', 3600)
+    def _load_routes(self):
+        pages = self.get_query_set().select_related(
+            'template',
+        ).prefetch_related('bit_groups')
 
-            cache.set(key, cached_group, int(timeout))
+        return dict(
+            (page.url, (page.template.path, [g.slug for g in page.bit_groups.all()]))
+            for page in pages
+        )
 
-        return cached_group
@@ -0,0 +1,47 @@
+import logging
+
+from django.conf import settings
+
+from .managers import request_store
+from .preload import preload
+from .views import store_response
+
+logger = logging.getLogger('pagebits')
+
+
+class PageBitsMiddleware(object):
+    """
+    Memoize BitGroups for the life of each request, so views, template tags
+    and includes asking for the same group only look it up once.
+
+    Responses marked for the response cache are stored here too, after
+    every middleware listed below this one has handled them.
+
+    With ``PAGEBITS_PRELOAD`` set, groups are also loaded into the local
+    cache when the middleware is set up, which Django does while handling
+    the first request.
+    """
+
+    def __init__(self):
+        if getattr(settings, 'PAGEBITS_PRELOAD', None):
+            # Django sets middleware up again on the next request when this
+            # raises, an unavailable database or cache mustn't fail them all
+            try:
+                preload()
+            except Exception:
+                logger.error(
+                    "Preloading pagebits failed, groups are loaded as requests "
+                    "ask for them instead",
+                    exc_info=True,
+                )
+
+    def process_request(self, request):
+        request_store.begin()
+
+    def process_response(self, request, response):
+        store_response(request, response)
+        request_store.end()
+        return response
+
+    def process_exception(self, request, exception):
+        request_store.end()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'BitGroup'
+        db.create_table('pagebits_bitgroup', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=100)),
+            ('slug', self.gf('django.db.models.fields.SlugField')(max_length=50)),
+            ('description', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('instructions', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('created', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+            ('modified', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+        ))
+        db.send_create_signal('pagebits', ['BitGroup'])
+
+        # Adding model 'PageBit'
+        db.create_table('pagebits_pagebit', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('type', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('group', self.gf('django.db.models.fields.related.ForeignKey')(related_name='bits', to=orm['pagebits.BitGroup'])),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=100)),
+            ('context_name', self.gf('django.db.models.fields.CharField')(max_length=100)),
+            ('order', self.gf('django.db.models.fields.IntegerField')(default=1)),
+            ('text_widget', self.gf('django.db.models.fields.CharField')(default='charfield', max_length=10)),
+            ('required', self.gf('django.db.models.fields.BooleanField')(default=False)),
+            ('help_text', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('created', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+            ('modified', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+        ))
+        db.send_create_signal('pagebits', ['PageBit'])
+
+        # Adding model 'PageData'
+        db.create_table('pagebits_pagedata', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('bit', self.gf('django.db.models.fields.related.OneToOneField')(related_name='data', unique=True, to=orm['pagebits.PageBit'])),
+            ('data', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('image', self.gf('django.db.models.fields.files.ImageField')(max_length=100, null=True, blank=True)),
+            ('created', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+            ('modified', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+        ))
+        db.send_create_signal('pagebits', ['PageData'])
+
+        # Adding model 'PageTemplate'
+        db.create_table('pagebits_pagetemplate', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=100)),
+            ('path', self.gf('django.db.models.fields.CharField')(max_length=200)),
+        ))
+        db.send_create_signal('pagebits', ['PageTemplate'])
+
+        # Adding model 'Page'
+        db.create_table('pagebits_page', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=100)),
+            ('url', self.gf('django.db.models.fields.CharField')(max_length=200, db_index=True)),
+            ('template', self.gf('django.db.models.fields.related.ForeignKey')(related_name='pages', to=orm['pagebits.PageTemplate'])),
+        ))
+        db.send_create_signal('pagebits', ['Page'])
+
+        # Adding M2M table for field bit_groups on 'Page'
+        db.create_table('pagebits_page_bit_groups', (
+            ('id', models.AutoField(verbose_name='ID', primary_key=True, auto_created=True)),
+            ('page', models.ForeignKey(orm['pagebits.page'], null=False)),
+            ('bitgroup', models.ForeignKey(orm['pagebits.bitgroup'], null=False))
+        ))
+        db.create_unique('pagebits_page_bit_groups', ['page_id', 'bitgroup_id'])
+
+    def backwards(self, orm):
+        # Removing M2M table for field bit_groups on 'Page'
+        db.delete_table('pagebits_page_bit_groups')
+
+        # Deleting model 'Page'
+        db.delete_table('pagebits_page')
+
+        # Deleting model 'PageTemplate'
+        db.delete_table('pagebits_pagetemplate')
+
+        # Deleting model 'PageData'
+        db.delete_table('pagebits_pagedata')
+
+        # Deleting model 'PageBit'
+        db.delete_table('pagebits_pagebit')
+
+        # Deleting model 'BitGroup'
+        db.delete_table('pagebits_bitgroup')
+
+    models = {
+        'pagebits.bitgroup': {
+            'Meta': {'ordering': "('name',)", 'object_name': 'BitGroup'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'instructions': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '50'})
+        },
+        'pagebits.page': {
+            'Meta': {'ordering': "('name',)", 'object_name': 'Page'},
+            'bit_groups': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'pages'", 'symmetrical': 'False', 'to': "orm['pagebits.BitGroup']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'template': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'pages'", 'to': "orm['pagebits.PageTemplate']"}),
+            'url': ('django.db.models.fields.CharField', [], {'max_length': '200', 'db_index': 'True'})
+        },
+        'pagebits.pagebit': {
+            'Meta': {'ordering': "('order', 'created')", 'object_name': 'PageBit'},
+            'context_name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'bits'", 'to': "orm['pagebits.BitGroup']"}),
+            'help_text': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'order': ('django.db.models.fields.IntegerField', [], {'default': '1'}),
+            'required': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'text_widget': ('django.db.models.fields.CharField', [], {'default': "'charfield'", 'max_length': '10'}),
+            'type': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        'pagebits.pagedata': {
+            'Meta': {'object_name': 'PageData'},
+            'bit': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'data'", 'unique': 'True', 'to': "orm['pagebits.PageBit']"}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'data': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.files.ImageField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'})
+        },
+        'pagebits.pagetemplate': {
+            'Meta': {'ordering': "('name',)", 'object_name': 'PageTemplate'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'path': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        }
+    }
+
+    complete_apps = ['pagebits']
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+DUPLICATE_SLUGS = (
+    "SELECT slug FROM pagebits_bitgroup "
+    "GROUP BY slug HAVING COUNT(*) > 1"
+)
+
+DUPLICATE_CONTEXT_NAMES = (
+    "SELECT g.slug, b.context_name FROM pagebits_pagebit b "
+    "JOIN pagebits_bitgroup g ON g.id = b.group_id "
+    "GROUP BY g.slug, b.context_name HAVING COUNT(*) > 1"
+)
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Fail with a list of what to fix rather than a bare IntegrityError
+        problems = ["BitGroup slug '%s'" % row[0] for row in db.execute(DUPLICATE_SLUGS)]
+        problems.extend(
+            "PageBit context_name '%s' in BitGroup '%s'" % (row[1], row[0])
+            for row in db.execute(DUPLICATE_CONTEXT_NAMES)
+        )
+        if problems:
+            raise RuntimeError(
+                "Rename or remove duplicates before migrating, these are used "
+                "more than once: %s" % ", ".join(problems)
+            )
+
+        # Adding unique constraint on 'BitGroup', fields ['slug']
+        db.create_unique('pagebits_bitgroup', ['slug'])
+
+        # Adding unique constraint on 'PageBit', fields ['group', 'context_name']
+        db.create_unique('pagebits_pagebit', ['group_id', 'context_name'])
+
+        # Adding index on 'PageBit', fields ['group', 'order', 'created'] to
+        # match the ordering the bits of a group are loaded in
+        db.create_index('pagebits_pagebit', ['group_id', 'order', 'created'])
+
+    def backwards(self, orm):
+        # Removing index on 'PageBit', fields ['group', 'order', 'created']
+        db.delete_index('pagebits_pagebit', ['group_id', 'order', 'created'])
+
+        # Removing unique constraint on 'PageBit', fields ['group', 'context_name']
+        db.delete_unique('pagebits_pagebit', ['group_id', 'context_name'])
+
+        # Removing unique constraint on 'BitGroup', fields ['slug']
+        db.delete_unique('pagebits_bitgroup', ['slug'])
+
+    models = {
+        'pagebits.bitgroup': {
+            'Meta': {'ordering': "('name',)", 'object_name': 'BitGroup'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'instructions': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '50'})
+        },
+        'pagebits.page': {
+            'Meta': {'ordering': "('name',)", 'object_name': 'Page'},
+            'bit_groups': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'pages'", 'symmetrical': 'False', 'to': "orm['pagebits.BitGroup']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'template': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'pages'", 'to': "orm['pagebits.PageTemplate']"}),
+            'url': ('django.db.models.fields.CharField', [], {'max_length': '200', 'db_index': 'True'})
+        },
+        'pagebits.pagebit': {
+            'Meta': {'ordering': "('order', 'created')", 'unique_together': "(('group', 'context_name'),)", 'object_name': 'PageBit'},
+            'context_name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'bits'", 'to': "orm['pagebits.BitGroup']"}),
+            'help_text': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'order': ('django.db.models.fields.IntegerField', [], {'default': '1'}),
+            'required': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'text_widget': ('django.db.models.fields.CharField', [], {'default': "'charfield'", 'max_length': '10'}),
+            'type': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        'pagebits.pagedata': {
+            'Meta': {'object_name': 'PageData'},
+            'bit': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'data'", 'unique': 'True', 'to': "orm['pagebits.PageBit']"}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'data': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.files.ImageField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'})
+        },
+        'pagebits.pagetemplate': {
+            'Meta': {'ordering': "('name',)", 'object_name': 'PageTemplate'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'path': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        }
+    }
+
+    complete_apps = ['pagebits']
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import datetime
+import re
+
+from south.db import db
+from south.v2 import DataMigration
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+
+try:
+    from importlib import import_module
+except ImportError:  # Python 2.6
+    from django.utils.importlib import import_module
+
+# A frozen copy of pagebits.processors as of this migration, so later
+# changes to it don't change what this migration does
+HTML = 1
+IMAGE = 2
+
+DEFAULT_PROCESSOR = 'pagebits.processors.normalize_html'
+
+PRESERVED_RE = re.compile(r'(<(pre|textarea|script|style)\b.*?</\2\s*>)', re.I | re.S)
+BETWEEN_TAGS_RE = re.compile(r'(^|>)\s*\n\s*(<|$)')
+BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+
+
+def normalize_html(html):
+    html = html.replace('\r\n', '\n').replace('\r', '\n').strip()
+    parts = PRESERVED_RE.split(html)
+
+    for i in range(0, len(parts), 3):
+        part = BETWEEN_TAGS_RE.sub(r'\1\n\2', parts[i])
+        parts[i] = BLANK_LINES_RE.sub('\n', part)
+
+    return ''.join(part for i, part in enumerate(parts) if i % 3 != 2)
+
+
+def html_processors():
+    """
+    Processors configured for the project, sanitizers in particular must
+    run on existing content too.  Only the default is frozen here.
+    """
+    processors = []
+    for path in getattr(settings, 'PAGEBITS_HTML_PROCESSORS', (DEFAULT_PROCESSOR, )):
+        if path == DEFAULT_PROCESSOR:
+            processors.append(normalize_html)
+            continue
+
+        module, attr = path.rsplit('.', 1)
+        try:
+            processors.append(getattr(import_module(module), attr))
+        except (ImportError, AttributeError) as e:
+            raise ImproperlyConfigured("Error loading HTML processor %s: %s" % (path, e))
+
+    return processors
+
+
+def render_data(bit_type, data, image, processors):
+    if bit_type == HTML:
+        for processor in processors:
+            data = processor(data)
+        return data
+    elif bit_type == IMAGE:
+        return image.url if image else ''
+
+    return ''
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Render the data of existing bits and record image dimensions"
+        processors = html_processors()
+
+        for data in orm['pagebits.PageData'].objects.select_related('bit'):
+            data.rendered = render_data(data.bit.type, data.data, data.image, processors)
+
+            if data.image:
+                try:
+                    data.image_width = data.image.width
+                    data.image_height = data.image.height
+                except (IOError, OSError):
+                    pass
+
+            data.save()
+
+    def backwards(self, orm):
+        "Nothing to undo, the columns are dropped by the previous migration"
+
+    models = {
+        'pagebits.bitgroup': {
+            'Meta': {'ordering': "('name',)", 'object_name': 'BitGroup'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'instructions': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '50'})
+        },
+        'pagebits.page': {
+            'Meta': {'ordering': "('name',)", 'object_name': 'Page'},
+            'bit_groups': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'pages'", 'symmetrical': 'False', 'to': "orm['pagebits.BitGroup']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'template': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'pages'", 'to': "orm['pagebits.PageTemplate']"}),
+            'url': ('django.db.models.fields.CharField', [], {'max_length': '200', 'db_index': 'True'})
+        },
+        'pagebits.pagebit': {
+            'Meta': {'ordering': "('order', 'created')", 'unique_together': "(('group', 'context_name'),)", 'object_name': 'PageBit'},
+            'context_name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'bits'", 'to': "orm['pagebits.BitGroup']"}),
+            'help_text': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'order': ('django.db.models.fields.IntegerField', [], {'default': '1'}),
+            'required': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'text_widget': ('django.db.models.fields.CharField', [], {'default': "'charfield'", 'max_length': '10'}),
+            'type': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        'pagebits.pagedata': {
+            'Meta': {'object_name': 'PageData'},
+            'bit': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'data'", 'unique': 'True', 'to': "orm['pagebits.PageBit']"}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'data': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.files.ImageField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'image_height': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'image_width': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'rendered': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'})
+        },
+        'pagebits.pagetemplate': {
+            'Meta': {'ordering': "('name',)", 'object_name': 'PageTemplate'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'path': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        }
+    }
+
+    complete_apps = ['pagebits']
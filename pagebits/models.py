@@ -1,21 +1,37 @@
-from django.db import models
-from django.core.cache import cache
-from django.core.exceptions import ValidationError
-from django.db.models.signals import post_save
+from django.db import IntegrityError, models, transaction
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_init,
+    post_save,
+    pre_save,
+)
 from django.dispatch import receiver
 from django.template.defaultfilters import slugify
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
-from .managers import BitGroupManager
-from .utils import bitgroup_cache_key
+from .managers import (
+    BitGroupManager,
+    PageBitManager,
+    PageDataManager,
+    PageManager,
+    PageTemplateManager,
+    bit_cache_enabled,
+    invalidate_groups,
+    invalidate_routes,
+    update_bit,
+)
+from .payload import pack_bit, timestamp
+from .processors import process_html, render_data
 
 
 class BitGroup(models.Model):
     """ A Page Group, which can be used on more than one logical page """
     name = models.CharField(_('Name'), max_length=100)
-    slug = models.SlugField()
+    slug = models.SlugField(unique=True)
     description = models.TextField(
         blank=True,
         help_text=_("Description show in the admin"),
@@ -106,34 +122,41 @@ class PageBit(models.Model):
     created = models.DateTimeField(default=timezone.now)
     modified = models.DateTimeField(default=timezone.now)
 
+    objects = PageBitManager()
+
     class Meta:
         ordering = ('order', 'created')
+        unique_together = (('group', 'context_name'), )
 
     def __unicode__(self):
         return self.name
 
-    def clean(self):
-        # Ensure our context_name and group__slug are unique together
+    def save(self, *args, **kwargs):
+        self.modified = timezone.now()
 
-        qs = self.__class__._default_manager.filter(
-            group__slug=self.group.slug,
-            context_name=self.context_name
-        )
+        # Uniqueness of context_name within the group is left to the
+        # database, instead of a query on every save
+        self.clean_fields()
+        self.clean()
 
-        # Exclude ourself in checking for duplicates
-        if self.pk:
-            qs = qs.exclude(pk=self.pk)
+        sid = transaction.savepoint()
+        try:
+            super(PageBit, self).save(*args, **kwargs)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
 
-        if qs.exists():
-            raise ValidationError(
-                "The name '%s' is already used in PageGroup '%s'" % (self.context_name, self.group.name)
-            )
+            duplicates = self.__class__._default_manager.filter(
+                group=self.group_id,
+                context_name=self.context_name,
+            ).exclude(pk=self.pk)
 
-    def save(self, *args, **kwargs):
-        self.modified = timezone.now()
-        self.full_clean()
+            if duplicates.exists():
+                raise ValidationError(
+                    "The name '%s' is already used in PageGroup '%s'" % (self.context_name, self.group.name)
+                )
+            raise
 
-        super(PageBit, self).save(*args, **kwargs)
+        transaction.savepoint_commit(sid)
 
     def resolve(self):
         if self.type == self.PLAIN_TEXT:
@@ -141,7 +164,7 @@ class PageBit(models.Model):
             return self.data.data
         elif self.type == self.HTML:
             # Mark HTML data safe to avoid escaping it in views
-            return mark_safe(self.data.data)
+            return mark_safe(self.data.rendered_html())
         elif self.type == self.IMAGE:
             # Return the actual image itself
             return self.data.image
@@ -150,16 +173,23 @@ class PageBit(models.Model):
 @receiver(post_save, sender=PageBit)
 def create_page_data(sender, instance, created, **kwargs):
     """ Handle automatically creating PageData items on creation """
-    # Do nothing if we're loading a fixture
     if kwargs.get('raw', False):
-        return
-
-    if created:
+        # Fixtures may or may not include the bit's data, make sure there
+        # is some and let a fixture row for it take over later
+        PageData.objects.get_or_create(bit=instance)
+    elif created:
         PageData.objects.create(bit=instance)
+    else:
+        # A change of type changes how the data renders, compare with what
+        # is stored rather than a copy cached on the instance
+        try:
+            data = PageData.objects.get(bit=instance)
+        except PageData.DoesNotExist:
+            return
 
-    # Bust the BitGroup cache
-    key = bitgroup_cache_key(instance.context_name)
-    cache.delete(key)
+        data.bit = instance
+        if data.rendered is None or data.render() != data.rendered:
+            data.save()
 
 
 class PageData(models.Model):
@@ -168,12 +198,22 @@ class PageData(models.Model):
     image = models.ImageField(
         upload_to='pagebits/data/images/',
         blank=True,
-        null=True
+        null=True,
+        width_field='image_width',
+        height_field='image_height',
     )
 
+    # Render-ready form of the data, kept up to date on save.  NULL for rows
+    # which were never rendered, an empty string is a valid rendering.
+    rendered = models.TextField(null=True, blank=True, editable=False)
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
     created = models.DateTimeField(default=timezone.now)
     modified = models.DateTimeField(default=timezone.now)
 
+    objects = PageDataManager()
+
     def __unicode__(self):
         return "%s - %s (%s)" % (
             self.bit.group.name,
@@ -185,11 +225,128 @@ class PageData(models.Model):
         verbose_name = _('Page Data')
         verbose_name_plural = _('Page Data')
 
+    def render(self):
+        # New uploads are stored first so their final URL is known
+        if self.image and not self.image._committed:
+            self.image.save(self.image.name, self.image, save=False)
+
+        return render_data(self.bit.type, self.data, self.image)
+
+    def rendered_html(self):
+        """
+        The processed markup of an HTML bit.  Rows which were never rendered
+        are processed now, raw markup is never served in their place.
+        """
+        if self.rendered is None:
+            return process_html(self.data)
+
+        return self.rendered
+
     def save(self, *args, **kwargs):
         self.modified = timezone.now()
+        self.rendered = self.render()
         super(PageData, self).save(*args, **kwargs)
 
 
+@receiver(pre_save, sender=PageData)
+def replace_page_data(sender, instance, **kwargs):
+    """ Data loaded from a fixture replaces any a bit was given on creation """
+    if kwargs.get('raw', False):
+        PageData.objects.filter(bit=instance.bit_id).exclude(pk=instance.pk).delete()
+
+
+def group_slugs(**filters):
+    return list(BitGroup.objects.filter(**filters).values_list('slug', flat=True))
+
+
+def related_slug(instance, *path):
+    """
+    The slug at the end of a chain of relations, using whatever is cached
+    on the instance.  Rows deleted in the same cascade have no slug, their
+    own signals invalidate them.
+    """
+    try:
+        for name in path:
+            instance = getattr(instance, name)
+    except ObjectDoesNotExist:
+        return []
+
+    return [instance.slug]
+
+
+@receiver(post_init, sender=BitGroup)
+@receiver(post_init, sender=PageEdit)
+@receiver(post_init, sender=PageBit)
+def remember_group(sender, instance, **kwargs):
+    """ Note which group an instance belongs to as loaded, before it changes """
+    if sender is PageBit:
+        instance._original_group_id = instance.__dict__.get('group_id')
+    else:
+        instance._original_slug = instance.__dict__.get('slug')
+
+
+@receiver(post_save, sender=BitGroup)
+@receiver(post_save, sender=PageEdit)
+@receiver(post_delete, sender=BitGroup)
+@receiver(post_delete, sender=PageEdit)
+def invalidate_bitgroup(sender, instance, **kwargs):
+    """ Invalidate a group under its current and, if renamed, old slug """
+    slugs = [instance.slug]
+    original = getattr(instance, '_original_slug', None)
+    if original not in (None, instance.slug):
+        slugs.append(original)
+
+    invalidate_groups(slugs)
+    instance._original_slug = instance.slug
+
+    # Pages list their groups by slug, in name order
+    invalidate_routes()
+
+
+@receiver(post_save, sender=PageBit)
+@receiver(post_delete, sender=PageBit)
+def invalidate_pagebit(sender, instance, signal, **kwargs):
+    """ Invalidate a bit's group, and the group it was moved from """
+    slugs = related_slug(instance, 'group')
+
+    # Only a move between groups needs the old group looked up
+    original = getattr(instance, '_original_group_id', None)
+    old_slugs = []
+    if original not in (None, instance.group_id):
+        old_slugs = group_slugs(pk=original)
+
+    invalidate_groups(slugs + old_slugs)
+    instance._original_group_id = instance.group_id
+
+    # Groups which lose a bit need a newer modified time, as the remaining
+    # bits can't provide one for their Last-Modified header
+    if signal is post_delete:
+        lost = slugs
+    else:
+        lost = old_slugs
+
+    if lost:
+        BitGroup.objects.filter(slug__in=lost).update(modified=timezone.now())
+
+
+@receiver(post_save, sender=PageData)
+@receiver(post_delete, sender=PageData)
+def invalidate_pagedata(sender, instance, signal, **kwargs):
+    """ Invalidate the group of the bit this data belongs to """
+    slugs = related_slug(instance, 'bit', 'group')
+
+    if signal is post_save and slugs and bit_cache_enabled():
+        # Only this bit needs storing again, the rest of the group is reused
+        update_bit(
+            slugs[0],
+            instance.bit_id,
+            pack_bit(instance.bit, instance),
+            timestamp(instance.modified),
+        )
+    else:
+        invalidate_groups(slugs)
+
+
 class PageTemplate(models.Model):
     """ Associate Template names to filesystem paths """
     name = models.CharField(
@@ -204,6 +361,8 @@ class PageTemplate(models.Model):
         help_text=_("Path to template in TEMPLATE_DIRS, for example 'pages/homepage.html'"),
     )
 
+    objects = PageTemplateManager()
+
     class Meta:
         verbose_name = _('Page Template')
         verbose_name_plural = _('Page Template')
@@ -225,7 +384,19 @@ class Page(models.Model):
     template = models.ForeignKey(PageTemplate, related_name='pages')
     bit_groups = models.ManyToManyField(BitGroup, related_name='pages')
 
+    objects = PageManager()
+
     class Meta:
         verbose_name = _('Page')
         verbose_name_plural = _('Pages')
         ordering = ('name', )
+
+
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+@receiver(post_save, sender=PageTemplate)
+@receiver(post_delete, sender=PageTemplate)
+@receiver(m2m_changed, sender=Page.bit_groups.through)
+def invalidate_page_routes(sender, **kwargs):
+    """ Rebuild the Page routing table whenever a page may have changed """
+    invalidate_routes()
@@ -0,0 +1,209 @@
+import calendar
+import time
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+from django.utils.encoding import smart_str
+from django.utils.safestring import mark_safe
+
+# Bump whenever the layout of a packed group changes, entries written in an
+# older format are then treated as cache misses instead of being misread.
+PAYLOAD_VERSION = 2
+
+# These match PageBit.PLAIN_TEXT, PageBit.HTML and PageBit.IMAGE, which can't
+# be imported here as models.py depends on the manager using this module.
+PLAIN_TEXT = 0
+HTML = 1
+IMAGE = 2
+
+
+class GroupBits(object):
+    """
+    Read-only mapping of a group's context names to bit values, along with
+    its slug, cache version and when its content was last modified as a
+    timestamp.  Values are only resolved the first time they are looked up,
+    so templates using a few bits of a large group don't pay for the rest.
+    """
+    __slots__ = ('slug', 'version', 'modified', '_bits', '_resolved')
+
+    def __init__(self, bits, slug=None, version=None, modified=None):
+        # Maps context names to their packed (context_name, type, value)
+        self._bits = bits
+        self._resolved = {}
+        self.slug = slug
+        self.version = version
+        self.modified = modified
+
+    @classmethod
+    def merge(cls, groups):
+        """ Combine several groups, bits in later groups win over earlier ones """
+        bits = {}
+        for group in groups:
+            bits.update(group._bits)
+
+        return cls(bits)
+
+    def __getitem__(self, key):
+        try:
+            return self._resolved[key]
+        except KeyError:
+            value = self._resolved[key] = resolve(self._bits[key])
+            return value
+
+    def get(self, key, default=None):
+        if key in self._bits:
+            return self[key]
+        return default
+
+    def __contains__(self, key):
+        return key in self._bits
+
+    def __iter__(self):
+        return iter(self._bits)
+
+    def __len__(self):
+        return len(self._bits)
+
+    def keys(self):
+        return list(self._bits)
+
+    def values(self):
+        return [self[key] for key in self._bits]
+
+    def items(self):
+        return [(key, self[key]) for key in self._bits]
+
+    def __eq__(self, other):
+        if isinstance(other, GroupBits):
+            other = dict(other.items())
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '<GroupBits %s: %s>' % (self.slug, ', '.join(sorted(self._bits)))
+
+
+class CachedImage(object):
+    """
+    Lightweight stand-in for an ImageFieldFile, built from cached values so
+    templates can use name, url, width and height without touching storage.
+    """
+    __slots__ = ('name', 'url', 'width', 'height')
+
+    def __init__(self, name, url, width, height):
+        self.name = name
+        self.url = url
+        self.width = width
+        self.height = height
+
+    def __unicode__(self):
+        return self.name
+
+    def __str__(self):
+        return smart_str(self.name)
+
+    def __eq__(self, other):
+        return self.name == getattr(other, 'name', other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.name)
+
+
+def pack_image(image, url=None, width=None, height=None):
+    """
+    Reduce an ImageFieldFile to a (name, url, width, height) tuple, using
+    the url and dimensions stored when it was saved where there are any
+    """
+    if not image:
+        return None
+
+    if url and width is not None and height is not None:
+        return (image.name, url, width, height)
+
+    try:
+        width, height = image.width, image.height
+    except (IOError, OSError):
+        # Missing or unreadable files shouldn't break the whole group
+        width, height = None, None
+
+    return (image.name, image.url, width, height)
+
+
+def timestamp(value):
+    """ Unix timestamp of a naive (local) or aware datetime """
+    if timezone.is_aware(value):
+        return calendar.timegm(value.utctimetuple())
+
+    return int(time.mktime(value.timetuple()))
+
+
+def bit_data(bit):
+    """ The PageData of a bit, or None for a bit which was saved without any """
+    try:
+        return bit.data
+    except ObjectDoesNotExist:
+        return None
+
+
+def pack_bit(bit, data):
+    """ Reduce a PageBit and its PageData to a (context_name, type, value) tuple """
+    if data is None:
+        value = None if bit.type == IMAGE else ''
+    elif bit.type == IMAGE:
+        value = pack_image(data.image, data.rendered, data.image_width, data.image_height)
+    elif bit.type == HTML:
+        value = data.rendered_html()
+    else:
+        value = data.data
+
+    return (bit.context_name, bit.type, value)
+
+
+def pack_group(group):
+    """
+    Build the cache payload for a BitGroup, a flat ordered list of
+    (context_name, type, value) tuples with no model instances in it, and
+    the latest modification time of the group, its bits and their data.
+    """
+    bits = []
+    modified = [group.modified]
+
+    for bit in group.bits.all():
+        data = bit_data(bit)
+        bits.append(pack_bit(bit, data))
+        modified.append(bit.modified)
+        if data is not None:
+            modified.append(data.modified)
+
+    return (PAYLOAD_VERSION, bits, timestamp(max(modified)))
+
+
+def resolve(bit):
+    """ The template value of a packed (context_name, type, value) bit """
+    bit_type, value = bit[1], bit[2]
+
+    if bit_type == HTML:
+        return mark_safe(value)
+    elif bit_type == IMAGE and value is not None:
+        return CachedImage(*value)
+
+    return value
+
+
+def unpack_group(payload, slug=None, version=None):
+    """
+    Rebuild the GroupBits of a packed group, returns None when the payload
+    isn't one we understand so the caller can reload it.
+    """
+    if not isinstance(payload, tuple) or payload[0] != PAYLOAD_VERSION:
+        return None
+
+    bits = dict((bit[0], bit) for bit in payload[1])
+    return GroupBits(bits, slug, version, payload[2])
@@ -0,0 +1,63 @@
+import logging
+import time
+
+from django.conf import settings
+
+from .managers import local_cache
+from .models import BitGroup, Page
+from .snapshot import snapshots
+
+logger = logging.getLogger('pagebits')
+
+
+def preload(slugs=None, batch_size=100):
+    """
+    Fill this process's local cache with BitGroups and the Page routing
+    table before it serves any requests.
+
+    Loads ``slugs``, or those listed in ``PAGEBITS_PRELOAD``, or every group
+    when that is ``True``.  Groups come from the shared cache where they are
+    already, the rest from the database ``batch_size`` at a time, and
+    loading stops once the local cache limits are reached.  With
+    ``PAGEBITS_SNAPSHOT`` set only the snapshot is mapped, and without any
+    local cache limits there is nowhere to keep groups so a warning is
+    logged instead.
+
+    Returns the number of groups and routes loaded and the time taken.
+    """
+    start = time.time()
+
+    if slugs is None:
+        slugs = getattr(settings, 'PAGEBITS_PRELOAD', None)
+        if slugs is True:
+            slugs = BitGroup.objects.order_by('slug').values_list('slug', flat=True)
+
+    slugs = list(slugs or [])
+    groups = 0
+
+    mapped = snapshots.get() is not None
+
+    if slugs and not mapped and not local_cache.enabled:
+        logger.warning(
+            "Not preloading %d groups, set PAGEBITS_LOCAL_CACHE_ENTRIES or "
+            "PAGEBITS_LOCAL_CACHE_BYTES to keep them in process memory",
+            len(slugs),
+        )
+    elif not mapped:
+        for offset in range(0, len(slugs), batch_size):
+            if local_cache.full():
+                break
+            groups += len(BitGroup.objects.get_groups(slugs[offset:offset + batch_size]))
+
+    stats = {
+        'groups': groups,
+        'routes': len(Page.objects.get_routes()),
+        'seconds': time.time() - start,
+    }
+
+    logger.info(
+        "Preloaded %(groups)d groups and %(routes)d page routes in %(seconds).2fs",
+        stats,
+    )
+
+    return stats
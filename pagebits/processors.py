@@ -0,0 +1,75 @@
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from importlib import import_module
+except ImportError:  # Python 2.6
+    from django.utils.importlib import import_module
+
+from .payload import HTML, IMAGE
+
+# Blocks whose whitespace is significant and left untouched
+PRESERVED_RE = re.compile(r'(<(pre|textarea|script|style)\b.*?</\2\s*>)', re.I | re.S)
+BETWEEN_TAGS_RE = re.compile(r'(^|>)\s*\n\s*(<|$)')
+BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+
+
+def normalize_html(html):
+    """
+    Tidy markup as produced by CKEditor without changing how it renders:
+    normalize line endings, strip surrounding whitespace, and collapse
+    indentation and blank lines between tags to a single newline
+    """
+    html = html.replace('\r\n', '\n').replace('\r', '\n').strip()
+    parts = PRESERVED_RE.split(html)
+
+    # split() also returns the tag name group, every third part from the
+    # start is ordinary markup and the one after it a preserved block
+    for i in range(0, len(parts), 3):
+        part = BETWEEN_TAGS_RE.sub(r'\1\n\2', parts[i])
+        parts[i] = BLANK_LINES_RE.sub('\n', part)
+
+    return ''.join(part for i, part in enumerate(parts) if i % 3 != 2)
+
+
+def html_processors():
+    """
+    The callables listed in ``PAGEBITS_HTML_PROCESSORS``, each takes and
+    returns a string of markup, for example to sanitize or minify it
+    """
+    paths = getattr(settings, 'PAGEBITS_HTML_PROCESSORS', (
+        'pagebits.processors.normalize_html',
+    ))
+
+    processors = []
+    for path in paths:
+        module, attr = path.rsplit('.', 1)
+        try:
+            processors.append(getattr(import_module(module), attr))
+        except (ImportError, AttributeError) as e:
+            raise ImproperlyConfigured("Error loading HTML processor %s: %s" % (path, e))
+
+    return processors
+
+
+def process_html(html):
+    for processor in html_processors():
+        html = processor(html)
+
+    return html
+
+
+def render_data(bit_type, data, image):
+    """
+    The render-ready form of a bit's data kept in PageData.rendered: HTML
+    after the processors have run, or the URL of an image.  Plain text is
+    left to be escaped by templates, so nothing is stored for it.
+    """
+    if bit_type == HTML:
+        return process_html(data)
+    elif bit_type == IMAGE:
+        return image.url if image else ''
+
+    return ''
@@ -0,0 +1,149 @@
+import json
+import mmap
+import os
+import threading
+
+from django.conf import settings
+from django.core.signals import request_started
+
+from .payload import PAYLOAD_VERSION, unpack_group
+
+SNAPSHOT_FORMAT = 'pagebits-snapshot'
+SNAPSHOT_VERSION = 1
+
+
+def write_snapshot(fileobj, payloads, routes, version):
+    """
+    Write a snapshot bundle of group payloads and the Page routing table.
+
+    The first line is a JSON header holding the snapshot version, the
+    routing table and the offset and length of each group, which follow as
+    one JSON line of ``[bits, modified]`` each.
+    """
+    lines = []
+    index = {}
+    offset = 0
+
+    for slug in sorted(payloads):
+        payload = payloads[slug]
+        line = json.dumps([payload[1], payload[2]], separators=(',', ':'))
+        line = line.encode('utf-8') + b'\n'
+
+        index[slug] = (offset, len(line))
+        offset += len(line)
+        lines.append(line)
+
+    header = json.dumps({
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'snapshot': version,
+        'routes': routes,
+        'groups': index,
+    }, separators=(',', ':'))
+
+    fileobj.write(header.encode('utf-8') + b'\n')
+    for line in lines:
+        fileobj.write(line)
+
+
+class Snapshot(object):
+    """
+    A snapshot bundle written by the ``pagebits_snapshot`` command, memory
+    mapped read-only.  Only the header is parsed up front, groups are
+    decoded from the mapping when asked for, so every process on a host
+    shares a single copy of the content through the page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        end = self._map.find(b'\n')
+        header = json.loads(self._map[:end].decode('utf-8'))
+
+        if header.get('format') != SNAPSHOT_FORMAT or header.get('version') != SNAPSHOT_VERSION:
+            raise ValueError("%s is not a pagebits snapshot this version can read" % path)
+
+        self._start = end + 1
+        self.version = header['snapshot']
+        self.index = header['groups']
+        self.routes = dict(
+            (url, (template_path, slugs))
+            for url, (template_path, slugs) in header['routes'].items()
+        )
+
+    def payload(self, slug):
+        """ The cache payload of a group, or None when it isn't in the snapshot """
+        try:
+            offset, length = self.index[slug]
+        except KeyError:
+            return None
+
+        start = self._start + offset
+        bits, modified = json.loads(self._map[start:start + length].decode('utf-8'))
+
+        return (PAYLOAD_VERSION, [tuple(bit) for bit in bits], modified)
+
+    def get_groups(self, slugs):
+        groups = []
+
+        for slug in slugs:
+            payload = self.payload(slug)
+            if payload is not None:
+                groups.append(unpack_group(payload, slug, self.version))
+
+        return groups
+
+    def changed(self):
+        """ Whether the file has been replaced since it was mapped """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+
+        return (stat.st_ino, stat.st_mtime) != (self.stat.st_ino, self.stat.st_mtime)
+
+
+class SnapshotLoader(object):
+    """
+    Holds the Snapshot named by ``PAGEBITS_SNAPSHOT`` for this process, a
+    replaced file is picked up by the next request
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def get(self):
+        """ The current Snapshot, or None when no snapshot is configured """
+        path = getattr(settings, 'PAGEBITS_SNAPSHOT', None)
+        if not path:
+            return None
+
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.path != path:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot.path != path:
+                    snapshot = self._snapshot = Snapshot(path)
+
+        return snapshot
+
+    def check(self):
+        # Readers still holding the old mapping keep working with it, the
+        # mapping is closed once it is garbage collected
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.changed():
+            self._snapshot = None
+
+
+snapshots = SnapshotLoader()
+
+
+def check_snapshot(sender, **kwargs):
+    snapshots.check()
+
+request_started.connect(check_snapshot)
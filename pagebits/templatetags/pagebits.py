@@ -1,22 +1,288 @@
+import hashlib
+import os
+
 from django import template
+from django.conf import settings
+from django.template import loader as template_loader
+from django.template.loader import get_template
+from django.template.loader_tags import ExtendsNode
+from django.utils.encoding import smart_str
 
+from ..cache import cache
 from ..models import BitGroup
+from ..payload import GroupBits
+from ..utils import cache_timeout, fragment_cache_key
 
 register = template.Library()
 
 
-@register.assignment_tag
-def pagebits(slug):
-    """ Return PageBits as a context variable by PageGroup slug """
-    data = {}
+def pagebits(*slugs):
+    """
+    Return PageBits as a context variable by PageGroup slug
+
+    Several slugs may be given, they are loaded together and later groups
+    override bits of the same name from earlier ones.
+    """
+    return GroupBits.merge(BitGroup.objects.get_groups(slugs))
+
+
+def literal(expression):
+    """ The value of a FilterExpression if it's a plain literal, else None """
+    if isinstance(expression.var, template.Variable) or expression.filters:
+        return None
+
+    return expression.var
+
+
+class PageBitsNode(template.Node):
+
+    def __init__(self, slugs, var_name):
+        self.slugs = slugs
+        self.var_name = var_name
+
+    @property
+    def literal_slugs(self):
+        return [s for s in map(literal, self.slugs) if s is not None]
+
+    def render(self, context):
+        context[self.var_name] = pagebits(*[s.resolve(context) for s in self.slugs])
+        return ''
+
+
+@register.tag('pagebits')
+def do_pagebits(parser, token):
+    """
+    Load PageBits into a context variable by PageGroup slug::
+
+        {% pagebits 'default-meta' 'homepage-meta' as bits %}
+    """
+    args = token.split_contents()
+    tag_name = args.pop(0)
+
+    if len(args) < 3 or args[-2] != 'as':
+        raise template.TemplateSyntaxError(
+            "'%s' tag requires one or more PageGroup slugs followed by "
+            "'as variable'" % tag_name
+        )
+
+    return PageBitsNode(
+        [parser.compile_filter(arg) for arg in args[:-2]],
+        args[-1],
+    )
+
 
+class TemplateAnalysis(object):
+    """
+    What the views need to know about a template, following extends and
+    includes: the group slugs it asks for, a fingerprint of its source and
+    the files it was loaded from along with their modification times
+    """
+    __slots__ = ('slugs', 'fingerprint', 'files')
+
+    def __init__(self, slugs, fingerprint, files):
+        self.slugs = slugs
+        self.fingerprint = fingerprint
+        self.files = files
+
+    def current(self):
+        return all(mtime(path) == stamp for path, stamp in self.files)
+
+    @property
+    def modified(self):
+        """ Unix timestamp of the most recently modified file, if known """
+        stamps = [stamp for path, stamp in self.files if stamp is not None]
+        return int(max(stamps)) if stamps else None
+
+
+# TemplateAnalysis of each template by name
+_analysis = {}
+
+
+def source_loaders():
+    """ The configured template loaders, with those of a cached loader """
+    loaders = template_loader.template_source_loaders
+    if loaders is None:
+        loaders = [
+            template_loader.find_template_loader(path)
+            for path in settings.TEMPLATE_LOADERS
+        ]
+
+    flat = []
+    for loader in loaders:
+        if loader is not None:
+            flat.extend(getattr(loader, 'loaders', [loader]))
+
+    return flat
+
+
+def template_source(name):
+    """ The source of a template and its file, (None, None) if no loader says """
+    for loader in source_loaders():
+        try:
+            return loader.load_template_source(name)
+        except (template.TemplateDoesNotExist, NotImplementedError):
+            continue
+
+    return None, None
+
+
+def mtime(path):
     try:
-        group = BitGroup.objects.get_group(slug=slug)
+        return os.path.getmtime(path)
+    except (OSError, TypeError):
+        return None
+
+
+def analyze_template(name):
+    """
+    The TemplateAnalysis of a template.  It's kept per template name, so
+    the template and its parents are only parsed again once one of their
+    files has changed, whether or not the cached template loader is used.
+    """
+    analysis = _analysis.get(name)
+
+    if analysis is None or not analysis.current():
+        names = [name]
+        slugs = []
+        for slug in collect_slugs(get_template(name).nodelist, set([name]), names):
+            if slug not in slugs:
+                slugs.append(slug)
+
+        fingerprint = hashlib.md5()
+        files = []
+        for n in names:
+            source, path = template_source(n)
+            fingerprint.update(smart_str("%s|%s|" % (n, source)))
+            if path is not None:
+                files.append((path, mtime(path)))
+
+        analysis = _analysis[name] = TemplateAnalysis(slugs, fingerprint.hexdigest(), files)
+
+    return analysis
+
+
+def template_group_slugs(name):
+    """
+    Every literal PageGroup slug a template asks for through our tags,
+    following extends and includes
+    """
+    return analyze_template(name).slugs
+
+
+def collect_slugs(nodelist, seen, names):
+    slugs = []
+
+    for node in nodelist.get_nodes_by_type(PageBitsNode):
+        slugs.extend(node.literal_slugs)
+
+    for node in nodelist.get_nodes_by_type(PageBitsCacheNode):
+        slugs.extend(node.literal_slugs)
+
+    related = []
+
+    for node in nodelist.get_nodes_by_type(ExtendsNode):
+        # Older Djangos keep a quoted parent name as a plain string
+        parent = node.parent_name
+        if isinstance(parent, template.FilterExpression):
+            parent = literal(parent)
+        related.append(parent)
+
+    for node in nodelist.get_nodes_by_type(template.Node):
+        # Constant includes carry their compiled template, others only a
+        # FilterExpression naming it
+        included = getattr(node, 'template', None)
+        if isinstance(included, template.FilterExpression):
+            related.append(literal(included))
+        elif hasattr(included, 'nodelist'):
+            related.append(included)
+
+    for item in related:
+        if item is None or item in seen:
+            continue
+        seen.add(item)
+
+        if isinstance(item, template.Template):
+            names.append(item.name)
+        else:
+            names.append(item)
+            try:
+                item = get_template(item)
+            except template.TemplateDoesNotExist:
+                continue
+
+        slugs.extend(collect_slugs(item.nodelist, seen, names))
+
+    return slugs
+
+
+class PageBitsCacheNode(template.Node):
+
+    def __init__(self, nodelist, slugs, vary_on, fragment):
+        self.nodelist = nodelist
+        self.slugs = slugs
+        self.vary_on = vary_on
+        self.fragment = fragment
+
+    @property
+    def literal_slugs(self):
+        return [s for s in map(literal, self.slugs) if s is not None]
+
+    def render(self, context):
+        slugs = [slug.resolve(context) for slug in self.slugs]
+        versions = [
+            "%s:%s" % (bits.slug, bits.version)
+            for bits in BitGroup.objects.get_groups(slugs)
+        ]
+        vary_on = [value.resolve(context) for value in self.vary_on]
+
+        key = fragment_cache_key(self.fragment, versions, vary_on)
+        value = cache.get(key)
+
+        if value is None:
+            value = self.nodelist.render(context)
+            cache.set(key, value, cache_timeout())
+
+        return value
+
+
+@register.tag
+def pagebits_cache(parser, token):
+    """
+    Cache the enclosed fragment for as long as the named PageGroups are
+    unchanged, optionally also varying on other template variables::
+
+        {% pagebits_cache 'homepage-content' vary_on request.LANGUAGE_CODE %}
+            ...
+        {% endpagebits_cache %}
+    """
+    args = token.split_contents()
+    tag_name = args.pop(0)
+
+    if 'vary_on' in args:
+        index = args.index('vary_on')
+        args, vary_on = args[:index], args[index + 1:]
+    else:
+        vary_on = []
+
+    if not args:
+        raise template.TemplateSyntaxError(
+            "'%s' tag requires at least one PageGroup slug" % tag_name
+        )
 
-        for bit in group.bits.all():
-            data[bit.context_name] = bit.resolve()
+    # Identify the fragment by its own source, so different blocks caching
+    # the same groups don't share an entry
+    remaining = list(parser.tokens)
+    nodelist = parser.parse(('end%s' % tag_name,))
+    parser.delete_first_token()
 
-    except BitGroup.DoesNotExist:
-        pass
+    consumed = remaining[:len(remaining) - len(parser.tokens)]
+    fragment = hashlib.md5(smart_str("|".join(
+        [token.contents] + ["%s:%s" % (t.token_type, t.contents) for t in consumed]
+    ))).hexdigest()
 
-    return data
+    return PageBitsCacheNode(
+        nodelist,
+        [parser.compile_filter(arg) for arg in args],
+        [parser.compile_filter(arg) for arg in vary_on],
+        fragment,
+    )
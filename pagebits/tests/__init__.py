@@ -1,4 +1,5 @@
 from .models import *
 from .views import *
 from .templatetags import *
-
+from .caching import *
+from .admin import *
@@ -0,0 +1,139 @@
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from ..admin import PageEditAdmin
+from ..managers import get_versions
+from ..models import BitGroup, PageBit, PageData, PageEdit
+
+
+class PageEditAdminTests(TestCase):
+
+    def setUp(self):
+        self.group = BitGroup.objects.create(name='testgroup')
+        self.bits = [
+            PageBit.objects.create(
+                name='bit %d' % i,
+                context_name='bit%d' % i,
+                type=PageBit.PLAIN_TEXT,
+                group=self.group
+            )
+            for i in range(10)
+        ]
+        self.admin = PageEditAdmin(PageEdit, admin.site)
+        self.request = RequestFactory().post('/')
+        self.obj = PageEdit.objects.get(pk=self.group.pk)
+
+    def get_form(self, data):
+        form_class = self.admin.get_form(self.request, self.obj)
+        form = form_class(data, instance=self.obj)
+        self.assertTrue(form.is_valid())
+        return form
+
+    def test_save_model(self):
+        BitGroup.objects.get_group('testgroup')
+        untouched = PageData.objects.get(bit=self.bits[0]).modified
+
+        data = dict(('bit_%s' % bit.pk, '') for bit in self.bits)
+        data['bit_%s' % self.bits[3].pk] = 'Changed'
+        form = self.get_form(data)
+
+        # The bits were loaded along with the form, one update is left
+        with self.assertNumQueries(1):
+            self.admin.save_model(self.request, self.obj, form, True)
+
+        self.assertEqual(BitGroup.objects.get_group('testgroup')['bit3'], 'Changed')
+        self.assertEqual(PageData.objects.get(bit=self.bits[0]).modified, untouched)
+
+    @override_settings(PAGEBITS_BIT_CACHE=True)
+    def test_save_model_bit_cache(self):
+        BitGroup.objects.get_group('testgroup')
+        version = get_versions(['testgroup'])['testgroup']
+
+        data = dict(('bit_%s' % bit.pk, '') for bit in self.bits)
+        data['bit_%s' % self.bits[3].pk] = 'Changed'
+        data['bit_%s' % self.bits[5].pk] = 'Also changed'
+        self.admin.save_model(self.request, self.obj, self.get_form(data), True)
+
+        # Both bits are stored under a single new version
+        self.assertEqual(get_versions(['testgroup'])['testgroup'], version + 1)
+
+        # Put back together from the cache, with just the edited bits new
+        with self.assertNumQueries(0):
+            bits = BitGroup.objects.get_group('testgroup')
+
+        self.assertEqual(bits['bit3'], 'Changed')
+        self.assertEqual(bits['bit5'], 'Also changed')
+        self.assertEqual(bits['bit0'], '')
+
+    def test_save_model_unchanged(self):
+        form = self.get_form(dict(('bit_%s' % bit.pk, '') for bit in self.bits))
+
+        with self.assertNumQueries(0):
+            self.admin.save_model(self.request, self.obj, form, True)
+
+    def test_form_class_cache(self):
+        with self.assertNumQueries(2):
+            form_class = self.admin.get_form(self.request, self.obj)
+
+        obj = PageEdit.objects.get(pk=self.group.pk)
+        self.assertTrue(self.admin.get_form(self.request, obj) is form_class)
+
+        # Current values are filled in per instance
+        self.bits[0].data.data = 'Current'
+        self.bits[0].data.save()
+        obj = PageEdit.objects.get(pk=self.group.pk)
+        form = self.admin.get_form(self.request, obj)(instance=obj)
+        self.assertEqual(form.initial['bit_%s' % self.bits[0].pk], 'Current')
+
+        # Changing the bits themselves builds a new class
+        self.bits[0].name = 'Renamed'
+        self.bits[0].save()
+        obj = PageEdit.objects.get(pk=self.group.pk)
+        form_class = self.admin.get_form(self.request, obj)
+        self.assertEqual(form_class.base_fields['bit_%s' % self.bits[0].pk].label, 'Renamed')
+
+    def tearDown(self):
+        cache.clear()
+
+
+class InvalidatingAdminTests(TestCase):
+
+    def setUp(self):
+        self.group = BitGroup.objects.create(name='testgroup')
+        PageBit.objects.create(
+            name='header',
+            context_name='header',
+            type=PageBit.PLAIN_TEXT,
+            group=self.group
+        )
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def test_invalidated_after_commit(self):
+        before = get_versions(['testgroup'])['testgroup']
+        seen = []
+
+        def record(sender, **kwargs):
+            seen.append(get_versions(['testgroup'])['testgroup'])
+
+        # The version doesn't change while the view's transaction is open
+        post_delete.connect(record, sender=PageBit)
+        try:
+            self.client.post(
+                '/admin/pagebits/bitgroup/%s/delete/' % self.group.pk,
+                {'post': 'yes'},
+            )
+        finally:
+            post_delete.disconnect(record, sender=PageBit)
+
+        self.assertFalse(BitGroup.objects.filter(pk=self.group.pk).exists())
+        self.assertEqual(seen, [before])
+        self.assertEqual(get_versions(['testgroup'])['testgroup'], before + 1)
+
+    def tearDown(self):
+        cache.clear()
@@ -0,0 +1,662 @@
+import threading
+import time
+
+from django.core.cache import cache, get_cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from .. import middleware
+from ..cache import COMPRESSED, codec
+from ..managers import (
+    BitGroupManager,
+    LocalCache,
+    acquire_lock,
+    deferred_invalidation,
+    get_versions,
+    local_cache,
+    refresh_pool,
+    release_locks,
+    request_store,
+)
+from ..middleware import PageBitsMiddleware
+from ..models import BitGroup, PageBit, PageData
+from ..payload import PAYLOAD_VERSION, timestamp
+from ..preload import preload
+from ..utils import bitgroup_cache_key, cache_timeout
+
+
+class LocalCacheTests(TestCase):
+
+    def setUp(self):
+        self.local = LocalCache()
+
+    @override_settings(PAGEBITS_LOCAL_CACHE_ENTRIES=2)
+    def test_lru_eviction(self):
+        self.local.set('a', 1)
+        self.local.set('b', 2)
+        self.assertEqual(self.local.get('a'), 1)
+
+        # 'b' is now the least recently used entry
+        self.local.set('c', 3)
+        self.assertEqual(self.local.get('b'), None)
+        self.assertEqual(self.local.get('a'), 1)
+        self.assertEqual(self.local.get('c'), 3)
+
+        stats = self.local.stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+
+    @override_settings(PAGEBITS_LOCAL_CACHE_BYTES=200)
+    def test_byte_limit(self):
+        self.local.set('big', 'x' * 500)
+        self.assertEqual(self.local.get('big'), None)
+
+        for i in range(10):
+            self.local.set(i, 'x' * 50)
+
+        self.assertTrue(self.local.stats()['bytes'] <= 200)
+        self.assertTrue(self.local.stats()['evictions'] > 0)
+
+    @override_settings(PAGEBITS_LOCAL_CACHE_ENTRIES=10)
+    def test_generation(self):
+        self.local.set('a', 1)
+
+        # Another worker changes content
+        LocalCache().bump()
+
+        # Not noticed until the generation is checked again
+        self.assertEqual(self.local.get('a'), 1)
+        self.local.expire()
+        self.assertEqual(self.local.get('a'), None)
+
+    @override_settings(PAGEBITS_LOCAL_CACHE_ENTRIES=10)
+    def test_manager_uses_local_cache(self):
+        group = BitGroup.objects.create(name='localgroup')
+        bit = PageBit.objects.create(
+            name='header',
+            context_name='header',
+            type=PageBit.PLAIN_TEXT,
+            group=group
+        )
+
+        with self.assertNumQueries(3):
+            BitGroup.objects.get_group('localgroup')
+
+        # Served from process memory even without the shared cache entry
+        version = get_versions(['localgroup'])['localgroup']
+        cache.delete(bitgroup_cache_key('localgroup', version))
+        with self.assertNumQueries(0):
+            BitGroup.objects.get_group('localgroup')
+
+        bit.save()
+        with self.assertNumQueries(3):
+            BitGroup.objects.get_group('localgroup')
+
+    @override_settings(PAGEBITS_LOCAL_CACHE_ENTRIES=10)
+    def test_sites_kept_apart(self):
+        group = BitGroup.objects.create(name='localgroup')
+        PageBit.objects.create(
+            name='header',
+            context_name='header',
+            type=PageBit.PLAIN_TEXT,
+            group=group
+        )
+
+        def site_key(site):
+            return lambda key: '%s:%s' % (site, key)
+
+        with override_settings(PAGEBITS_CACHE_KEY_FUNCTION=site_key('site1')):
+            generation = local_cache.generation()
+            BitGroup.objects.get_group('localgroup')
+
+        # Another site's generation may well have the same value, its
+        # groups are loaded regardless
+        with override_settings(PAGEBITS_CACHE_KEY_FUNCTION=site_key('site2')):
+            cache.set('site2:pagebits-generation', generation)
+            with self.assertNumQueries(3):
+                BitGroup.objects.get_group('localgroup')
+
+    @override_settings(PAGEBITS_LOCAL_CACHE_ENTRIES=2, PAGEBITS_PRELOAD=True)
+    def test_preload(self):
+        for name in ('first', 'second', 'third'):
+            BitGroup.objects.create(name=name)
+
+        # Loading stops once the local cache is full
+        stats = preload(batch_size=1)
+        self.assertEqual(stats['groups'], 2)
+
+        with self.assertNumQueries(0):
+            groups = BitGroup.objects.get_groups(['first', 'second'])
+        self.assertEqual(len(groups), 2)
+
+    @override_settings(PAGEBITS_PRELOAD=True)
+    def test_preload_errors(self):
+        BitGroup.objects.create(name='first')
+
+        # Without a local cache nothing is loaded, which is logged
+        self.assertEqual(preload()['groups'], 0)
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("Cache unavailable")
+
+        errors = []
+
+        def error(*args, **kwargs):
+            errors.append(kwargs)
+
+        original = middleware.preload
+        middleware.preload, middleware.logger.error = fail, error
+        try:
+            # Requests are still served when preloading fails, the failure
+            # is logged as an error
+            PageBitsMiddleware()
+        finally:
+            middleware.preload = original
+            del middleware.logger.error
+
+        self.assertEqual(errors, [{'exc_info': True}])
+
+    def tearDown(self):
+        local_cache.clear()
+        local_cache.expire()
+        cache.clear()
+
+
+class InvalidationTests(TestCase):
+    """ Every write path has to move a group on to a new cache version """
+
+    def setUp(self):
+        self.group = BitGroup.objects.create(name='testgroup')
+        self.bit = PageBit.objects.create(
+            name='header',
+            context_name='header',
+            type=PageBit.PLAIN_TEXT,
+            group=self.group
+        )
+        self.other = BitGroup.objects.create(name='othergroup')
+
+    def assertInvalidates(self, action, slugs=('testgroup', )):
+        for slug in slugs:
+            try:
+                BitGroup.objects.get_group(slug)
+            except BitGroup.DoesNotExist:
+                pass
+
+        before = get_versions(slugs)
+        action()
+        after = get_versions(slugs)
+
+        for slug in slugs:
+            self.assertNotEqual(before[slug], after[slug], slug)
+
+    def test_pagedata_save(self):
+        def action():
+            self.bit.data.data = 'Changed'
+            self.bit.data.save()
+
+        self.assertInvalidates(action)
+        self.assertEqual(BitGroup.objects.get_group('testgroup')['header'], 'Changed')
+
+    def test_pagedata_save_queries(self):
+        data = self.bit.data
+        data.data = 'Changed'
+
+        # The group comes from the instances already loaded, saving only
+        # checks for and updates the row
+        with self.assertNumQueries(2):
+            data.save()
+
+    def test_pagedata_delete(self):
+        self.assertInvalidates(lambda: PageData.objects.get(bit=self.bit).delete())
+
+    def test_pagedata_update(self):
+        def action():
+            PageData.objects.filter(bit=self.bit).update(data='Bulk')
+
+        self.assertInvalidates(action)
+        self.assertEqual(BitGroup.objects.get_group('testgroup')['header'], 'Bulk')
+
+    def test_pagebit_create(self):
+        def action():
+            PageBit.objects.create(
+                name='footer',
+                context_name='footer',
+                type=PageBit.PLAIN_TEXT,
+                group=self.group
+            )
+
+        self.assertInvalidates(action)
+        self.assertTrue('footer' in BitGroup.objects.get_group('testgroup'))
+
+    def test_pagebit_save(self):
+        def action():
+            self.bit.context_name = 'title'
+            self.bit.save()
+
+        self.assertInvalidates(action)
+        self.assertTrue('title' in BitGroup.objects.get_group('testgroup'))
+
+    def test_pagebit_move(self):
+        def action():
+            self.bit.group = self.other
+            self.bit.save()
+
+        self.assertInvalidates(action, ('testgroup', 'othergroup'))
+        self.assertEqual(BitGroup.objects.get_group('testgroup'), {})
+        self.assertTrue('header' in BitGroup.objects.get_group('othergroup'))
+
+    def test_pagebit_delete(self):
+        self.assertInvalidates(self.bit.delete)
+        self.assertEqual(BitGroup.objects.get_group('testgroup'), {})
+
+    def test_pagebit_update(self):
+        def action():
+            PageBit.objects.filter(pk=self.bit.pk).update(group=self.other)
+
+        self.assertInvalidates(action, ('testgroup', 'othergroup'))
+
+    def test_pagebit_queryset_delete(self):
+        self.assertInvalidates(self.group.bits.all().delete)
+
+    def test_related_manager_update(self):
+        self.assertInvalidates(lambda: self.group.bits.update(context_name='title'))
+
+    def test_bitgroup_save(self):
+        self.assertInvalidates(self.group.save)
+
+    def test_bitgroup_rename(self):
+        def action():
+            self.group.slug = 'renamed'
+            self.group.save()
+
+        self.assertInvalidates(action, ('testgroup', 'renamed'))
+        with self.assertRaises(BitGroup.DoesNotExist):
+            BitGroup.objects.get_group('testgroup')
+
+    def test_bitgroup_update(self):
+        def action():
+            BitGroup.objects.filter(pk=self.group.pk).update(slug='renamed')
+
+        self.assertInvalidates(action, ('testgroup', 'renamed'))
+        with self.assertRaises(BitGroup.DoesNotExist):
+            BitGroup.objects.get_group('testgroup')
+
+    def test_bitgroup_delete(self):
+        self.assertInvalidates(self.group.delete)
+        with self.assertRaises(BitGroup.DoesNotExist):
+            BitGroup.objects.get_group('testgroup')
+
+    def test_missing_group(self):
+        with self.assertRaises(BitGroup.DoesNotExist):
+            BitGroup.objects.get_group('nothere')
+
+        # Remembered until a group with the slug is created
+        with self.assertNumQueries(0):
+            with self.assertRaises(BitGroup.DoesNotExist):
+                BitGroup.objects.get_group('nothere')
+
+        BitGroup.objects.create(name='nothere')
+        self.assertEqual(BitGroup.objects.get_group('nothere'), {})
+
+    def test_deferred(self):
+        before = get_versions(['testgroup'])['testgroup']
+
+        with deferred_invalidation():
+            self.bit.data.data = 'Changed'
+            self.bit.data.save()
+            self.bit.save()
+            self.assertEqual(get_versions(['testgroup'])['testgroup'], before)
+
+        # Bumped once for both saves
+        self.assertEqual(get_versions(['testgroup'])['testgroup'], before + 1)
+
+    def tearDown(self):
+        cache.clear()
+
+
+class BitCacheTests(TestCase):
+    """ With PAGEBITS_BIT_CACHE editing a bit doesn't reload its group """
+
+    def setUp(self):
+        self.group = BitGroup.objects.create(name='testgroup')
+        for name in ('header', 'body', 'footer'):
+            PageBit.objects.create(
+                name=name,
+                context_name=name,
+                type=PageBit.PLAIN_TEXT,
+                group=self.group
+            )
+
+    @override_settings(PAGEBITS_BIT_CACHE=True)
+    def test_edit_reuses_cached_bits(self):
+        BitGroup.objects.get_group('testgroup')
+
+        data = PageData.objects.get(bit__context_name='body')
+        data.data = 'Changed'
+        data.save()
+
+        with self.assertNumQueries(0):
+            bits = BitGroup.objects.get_group('testgroup')
+
+        self.assertEqual(bits, {'header': '', 'body': 'Changed', 'footer': ''})
+        self.assertEqual(bits.modified, timestamp(data.modified))
+
+    @override_settings(PAGEBITS_BIT_CACHE=True)
+    def test_new_bit_reloads(self):
+        BitGroup.objects.get_group('testgroup')
+
+        PageBit.objects.create(
+            name='extra',
+            context_name='extra',
+            type=PageBit.PLAIN_TEXT,
+            group=self.group
+        )
+
+        bits = BitGroup.objects.get_group('testgroup')
+        self.assertEqual(sorted(bits.keys()), ['body', 'extra', 'footer', 'header'])
+
+    def tearDown(self):
+        cache.clear()
+
+
+class CompressionTests(TestCase):
+    """ Groups over PAGEBITS_COMPRESS_THRESHOLD are stored compressed """
+
+    def setUp(self):
+        self.group = BitGroup.objects.create(name='biggroup')
+        bit = PageBit.objects.create(
+            name='body',
+            context_name='body',
+            type=PageBit.PLAIN_TEXT,
+            group=self.group
+        )
+        data = bit.data
+        data.data = 'Lorem ipsum dolor sit amet. ' * 200
+        data.save()
+        codec.reset()
+
+    def cache_key(self):
+        return bitgroup_cache_key('biggroup', get_versions(['biggroup'])['biggroup'])
+
+    @override_settings(PAGEBITS_COMPRESS_THRESHOLD=1024)
+    def test_compressed(self):
+        bits = BitGroup.objects.get_group('biggroup')
+
+        stored = cache.get(self.cache_key())
+        self.assertEqual(stored[0], COMPRESSED)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(BitGroup.objects.get_group('biggroup'), bits)
+
+        stats = codec.stats()
+        self.assertEqual(stats['encoded'], 1)
+        self.assertEqual(stats['decoded'], 1)
+        self.assertTrue(stats['ratio'] < 0.5)
+
+    def test_uncompressed_entries_read(self):
+        bits = BitGroup.objects.get_group('biggroup')
+        self.assertNotEqual(cache.get(self.cache_key())[0], COMPRESSED)
+
+        # Entries written before compression was turned on still load
+        with override_settings(PAGEBITS_COMPRESS_THRESHOLD=1024):
+            with self.assertNumQueries(0):
+                self.assertEqual(BitGroup.objects.get_group('biggroup'), bits)
+
+    def tearDown(self):
+        cache.clear()
+
+
+class CacheSettingsTests(TestCase):
+
+    def setUp(self):
+        self.group = BitGroup.objects.create(name='testgroup')
+        PageBit.objects.create(
+            name='header',
+            context_name='header',
+            type=PageBit.PLAIN_TEXT,
+            group=self.group
+        )
+
+    def cache_key(self):
+        return bitgroup_cache_key('testgroup', get_versions(['testgroup'])['testgroup'])
+
+    def test_timeout_setting(self):
+        with override_settings(PAGEBIT_CACHE_TIMEOUT=60):
+            self.assertEqual(cache_timeout(), 60)
+
+        with override_settings(PAGEBIT_CACHE_TIMEOUT=60, PAGEBITS_CACHE_TIMEOUT=120):
+            self.assertEqual(cache_timeout(), 120)
+
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'pagebits': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'pagebits-tests',
+            },
+        },
+        PAGEBITS_CACHE_ALIAS='pagebits',
+    )
+    def test_alias(self):
+        BitGroup.objects.get_group('testgroup')
+
+        key = self.cache_key()
+        self.assertEqual(cache.get(key), None)
+        self.assertNotEqual(get_cache('pagebits').get(key), None)
+
+        get_cache('pagebits').clear()
+
+    def test_version(self):
+        BitGroup.objects.get_group('testgroup')
+
+        with self.assertNumQueries(0):
+            BitGroup.objects.get_group('testgroup')
+
+        # A new cache version starts from an empty cache
+        with override_settings(PAGEBITS_CACHE_VERSION=2):
+            with self.assertNumQueries(3):
+                BitGroup.objects.get_group('testgroup')
+
+            self.assertNotEqual(cache.get(self.cache_key(), version=2), None)
+
+    def test_key_function(self):
+        with override_settings(PAGEBITS_CACHE_KEY_FUNCTION=lambda key: 'site1:' + key):
+            self.assertEqual(bitgroup_cache_key('testgroup', 3), 'site1:pagebits:testgroup:3')
+            self.assertEqual(BitGroup.objects.get_group('testgroup'), {'header': ''})
+
+        # Each site has versions and content of its own
+        with override_settings(PAGEBITS_CACHE_KEY_FUNCTION=lambda key: 'site2:' + key):
+            with self.assertNumQueries(3):
+                BitGroup.objects.get_group('testgroup')
+
+    def tearDown(self):
+        cache.clear()
+
+
+class WarmCommandTests(TestCase):
+
+    def setUp(self):
+        for name in ('first', 'second', 'third'):
+            group = BitGroup.objects.create(name=name)
+            PageBit.objects.create(
+                name='header',
+                context_name='header',
+                type=PageBit.PLAIN_TEXT,
+                group=group
+            )
+
+    def test_warm_all(self):
+        call_command('pagebits_warm', batch_size=2, verbosity=0)
+
+        with self.assertNumQueries(0):
+            groups = BitGroup.objects.get_groups(['first', 'second', 'third'])
+
+        self.assertEqual(len(groups), 3)
+
+    def test_warm_slugs(self):
+        call_command('pagebits_warm', 'second', verbosity=0)
+
+        with self.assertNumQueries(0):
+            BitGroup.objects.get_group('second')
+
+        with self.assertNumQueries(3):
+            BitGroup.objects.get_group('first')
+
+    def tearDown(self):
+        cache.clear()
+
+
+class StampedeTests(TestCase):
+    """ Misses and early refreshes rebuild an entry in a single place """
+
+    def setUp(self):
+        self.calls = []
+        self.original_load = BitGroupManager._load_payloads
+
+        def slow_load(manager, slugs):
+            self.calls.append(sorted(slugs))
+            time.sleep(0.2)
+            return dict(
+                (slug, (PAYLOAD_VERSION, [('header', 0, slug)], None))
+                for slug in slugs
+            )
+
+        BitGroupManager._load_payloads = slow_load
+
+    def key(self, slug):
+        return bitgroup_cache_key(slug, get_versions([slug])[slug])
+
+    def test_single_flight(self):
+        results = []
+
+        def fetch():
+            results.append(BitGroup.objects.get_group('hot'))
+
+        threads = [threading.Thread(target=fetch) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, [['hot']])
+        self.assertEqual(results, [{'header': 'hot'}] * 5)
+
+    def test_early_refresh(self):
+        # An entry which is already due to expire is rebuilt by the request
+        # which notices
+        old = (PAYLOAD_VERSION, [('header', PageBit.PLAIN_TEXT, 'old')], None)
+        cache.set(self.key('hot'), (old, time.time() - 1, 0.1))
+
+        self.assertEqual(BitGroup.objects.get_group('hot'), {'header': 'hot'})
+        self.assertEqual(self.calls, [['hot']])
+
+    def test_early_refresh_locked(self):
+        # Someone else is refreshing, keep serving the current value
+        old = (PAYLOAD_VERSION, [('header', PageBit.PLAIN_TEXT, 'old')], None)
+        cache.set(self.key('hot'), (old, time.time() - 1, 0.1))
+        acquire_lock(self.key('hot'))
+
+        self.assertEqual(BitGroup.objects.get_group('hot'), {'header': 'old'})
+        self.assertEqual(self.calls, [])
+
+    def test_lock_holder_gone(self):
+        # A miss waits briefly for the lock holder, then builds it itself
+        acquire_lock(self.key('hot'))
+
+        self.assertEqual(BitGroup.objects.get_group('hot'), {'header': 'hot'})
+        self.assertEqual(self.calls, [['hot']])
+
+    @override_settings(PAGEBITS_LOCK_WAIT=5)
+    def test_lock_released(self):
+        # Waiting stops once the lock holder is done, even without an entry
+        key = self.key('hot')
+        acquire_lock(key)
+        threading.Timer(0.2, release_locks, [[key]]).start()
+
+        start = time.time()
+        self.assertEqual(BitGroup.objects.get_group('hot'), {'header': 'hot'})
+        self.assertTrue(time.time() - start < 2)
+
+    @override_settings(PAGEBITS_STALE_TTL=60)
+    def test_stale_while_revalidate(self):
+        old = (PAYLOAD_VERSION, [('header', PageBit.PLAIN_TEXT, 'old')], None)
+        cache.set(self.key('hot'), (old, time.time() - 1, 0.1))
+
+        # The expired value comes straight back, the refresh runs elsewhere
+        self.assertEqual(BitGroup.objects.get_group('hot'), {'header': 'old'})
+        refresh_pool.join()
+
+        self.assertEqual(self.calls, [['hot']])
+        self.assertEqual(BitGroup.objects.get_group('hot'), {'header': 'hot'})
+
+    @override_settings(PAGEBITS_CACHE_TIMEOUT=1, PAGEBITS_STALE_TTL=60)
+    def test_version_outlives_entry(self):
+        BitGroup.objects.get_group('hot')
+        versions = get_versions(['hot'])
+
+        # Let the entry expire along with anything written at the same time
+        time.sleep(1.5)
+
+        # The version is still there, so the expired entry is found and
+        # served while it is refreshed rather than reloaded synchronously
+        self.assertEqual(get_versions(['hot']), versions)
+        BitGroup.objects.get_group('hot')
+        refresh_pool.join()
+
+        self.assertEqual(self.calls, [['hot'], ['hot']])
+        self.assertEqual(get_versions(['hot']), versions)
+
+    def tearDown(self):
+        BitGroupManager._load_payloads = self.original_load
+        cache.clear()
+
+
+class RequestStoreTests(TestCase):
+
+    def setUp(self):
+        self.group = BitGroup.objects.create(name='testgroup')
+        self.bit = PageBit.objects.create(
+            name='header',
+            context_name='header',
+            type=PageBit.PLAIN_TEXT,
+            group=self.group
+        )
+
+    def test_memoized_per_request(self):
+        request_store.begin()
+
+        with self.assertNumQueries(4):
+            BitGroup.objects.get_group('testgroup')
+            self.assertEqual(BitGroup.objects.get_groups(['missing']), [])
+
+        # Not even the cache is asked again
+        cache.clear()
+        with self.assertNumQueries(0):
+            BitGroup.objects.get_group('testgroup')
+            BitGroup.objects.get_groups(['testgroup', 'missing'])
+
+        # Edits made during the request are seen
+        self.bit.data.data = 'Changed'
+        self.bit.data.save()
+        self.assertEqual(BitGroup.objects.get_group('testgroup')['header'], 'Changed')
+
+        request_store.end()
+        cache.clear()
+        with self.assertNumQueries(3):
+            BitGroup.objects.get_group('testgroup')
+
+    @override_settings(MIDDLEWARE_CLASSES=(
+        'pagebits.middleware.PageBitsMiddleware',
+    ))
+    def test_middleware(self):
+        self.client.get('/test/')
+        self.assertEqual(request_store.groups, None)
+
+    def tearDown(self):
+        request_store.end()
+        cache.clear()
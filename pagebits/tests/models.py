@@ -1,8 +1,12 @@
+from django.core.cache import cache
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.core.exceptions import ValidationError
-from django.utils.safestring import SafeText
+from django.utils.safestring import SafeData, SafeText
 
+from ..managers import get_versions, unwrap_entry
 from ..models import BitGroup, PageBit, PageData
+from ..payload import PAYLOAD_VERSION, timestamp, unpack_group
 from ..utils import bitgroup_cache_key
 
 
@@ -34,6 +38,9 @@ class PageBitModelTests(TestCase):
         t1 = bitgroup_cache_key('foo1')
         self.assertEqual(t1, 'pagebits:foo1')
 
+        t2 = bitgroup_cache_key('foo1', 3)
+        self.assertEqual(t2, 'pagebits:foo1:3')
+
     def test_uniqueness(self):
         group2 = BitGroup.objects.create(name='TestGroup2')
 
@@ -65,6 +72,54 @@ class PageBitModelTests(TestCase):
         with self.assertNumQueries(0):
             BitGroup.objects.get_group('testgroup1')
 
+    def test_manager_get_groups(self):
+        """ Test that several groups load in one batch, in order """
+        group2 = BitGroup.objects.create(name='TestGroup2')
+        PageBit.objects.create(
+            name='footer',
+            context_name='footer',
+            type=PageBit.PLAIN_TEXT,
+            group=group2
+        )
+
+        with self.assertNumQueries(3):
+            groups = BitGroup.objects.get_groups(
+                ['testgroup2', 'missing', 'testgroup1']
+            )
+
+        self.assertEqual(
+            [sorted(bits.keys()) for bits in groups],
+            [['footer'], ['header', 'header2']],
+        )
+
+        with self.assertNumQueries(0):
+            BitGroup.objects.get_groups(['testgroup1', 'testgroup2'])
+
+        with self.assertRaises(BitGroup.DoesNotExist):
+            BitGroup.objects.get_group('missing')
+
+    def test_cached_payload(self):
+        """ Test the cache holds a plain payload, not model instances """
+        self.bit1.data.data = 'Header'
+        self.bit1.data.save()
+
+        BitGroup.objects.get_group('testgroup1')
+        version = get_versions(['testgroup1'])['testgroup1']
+        key = bitgroup_cache_key('testgroup1', version)
+        payload = unwrap_entry(cache.get(key))[0]
+
+        self.assertEqual(payload[:2], (PAYLOAD_VERSION, [
+            ('header', PageBit.PLAIN_TEXT, 'Header'),
+            ('header2', PageBit.PLAIN_TEXT, ''),
+        ]))
+        self.assertEqual(payload[2], timestamp(self.bit1.data.modified))
+        self.assertEqual(unpack_group(payload), {'header': 'Header', 'header2': ''})
+
+        # Payloads in a format we don't know are reloaded
+        cache.set(key, (0, []))
+        with self.assertNumQueries(3):
+            BitGroup.objects.get_group('testgroup1')
+
     def test_resolve(self):
         bit3 = PageBit.objects.create(
             name='markup',
@@ -76,3 +131,123 @@ class PageBitModelTests(TestCase):
         self.assertFalse(isinstance(self.bit1.resolve(), SafeText))
         self.assertFalse(isinstance(self.bit2.resolve(), SafeText))
         self.assertTrue(isinstance(bit3.resolve(), SafeText))
+
+    def test_rendered(self):
+        bit = PageBit.objects.create(
+            name='markup',
+            context_name='markup',
+            type=PageBit.HTML,
+            group=self.group1
+        )
+        bit.data.data = '  <p>Hello</p>\r\n\r\n    <p>There</p>\n'
+        bit.data.save()
+
+        self.assertEqual(bit.data.rendered, '<p>Hello</p>\n<p>There</p>')
+        self.assertEqual(
+            BitGroup.objects.get_group('testgroup1')['markup'],
+            '<p>Hello</p>\n<p>There</p>',
+        )
+
+        with override_settings(PAGEBITS_HTML_PROCESSORS=(
+            'pagebits.processors.normalize_html',
+            'django.utils.html.strip_tags',
+        )):
+            bit.data.save()
+            self.assertEqual(bit.data.rendered, 'Hello\nThere')
+
+            # Markup a sanitizer removes entirely is never served raw
+            bit.data.data = '<script></script>'
+            bit.data.save()
+            self.assertEqual(bit.data.rendered, '')
+            self.assertEqual(BitGroup.objects.get_group('testgroup1')['markup'], '')
+
+            # Neither is markup of rows which were never rendered
+            PageData.objects.filter(bit=bit).update(rendered=None)
+            self.assertEqual(BitGroup.objects.get_group('testgroup1')['markup'], '')
+
+        # Plain text is left for templates to escape
+        bit.type = PageBit.PLAIN_TEXT
+        bit.save()
+        data = PageData.objects.get(bit=bit)
+        self.assertEqual(data.rendered, '')
+        self.assertEqual(BitGroup.objects.get_group('testgroup1')['markup'], data.data)
+
+    def test_lazy_bits(self):
+        """ Test bits are only resolved when looked up, then kept """
+        bits = unpack_group((PAYLOAD_VERSION, [
+            ('header', PageBit.HTML, '<b>Header</b>'),
+            ('footer', PageBit.HTML, '<i>Footer</i>'),
+        ], 0))
+
+        self.assertEqual(sorted(bits.keys()), ['footer', 'header'])
+        self.assertEqual(bits._resolved, {})
+
+        header = bits['header']
+        self.assertTrue(isinstance(header, SafeData))
+        self.assertTrue(bits['header'] is header)
+        self.assertEqual(list(bits._resolved), ['header'])
+        self.assertEqual(bits.get('missing', 'default'), 'default')
+
+        with self.assertRaises(KeyError):
+            bits['missing']
+
+        other = unpack_group((PAYLOAD_VERSION, [
+            ('footer', PageBit.PLAIN_TEXT, 'Other'),
+        ], 0))
+        merged = type(bits).merge([bits, other])
+        self.assertEqual(merged, {'header': header, 'footer': 'Other'})
+
+    def test_bulk_provision(self):
+        spec = {'groups': [
+            {'name': 'Homepage', 'bits': [
+                {'name': 'Header', 'context_name': 'header', 'type': 'html', 'data': '<h1>Hi</h1>'},
+                {'name': 'Intro', 'context_name': 'intro', 'required': True},
+            ]},
+            {'name': 'Footer', 'slug': 'site-footer', 'bits': [
+                {'name': 'Copyright', 'context_name': 'copyright', 'data': '2013'},
+            ]},
+        ]}
+
+        with self.assertNumQueries(6):
+            self.assertEqual(BitGroup.objects.bulk_provision(spec), (2, 3))
+
+        homepage = BitGroup.objects.get_group('homepage')
+        self.assertEqual(homepage, {'header': '<h1>Hi</h1>', 'intro': ''})
+        self.assertTrue(isinstance(homepage['header'], SafeText))
+        self.assertEqual(BitGroup.objects.get_group('site-footer')['copyright'], '2013')
+
+        # Existing groups get the new bits, names must stay unique
+        BitGroup.objects.bulk_provision([{'name': 'Homepage', 'bits': [
+            {'name': 'Outro', 'context_name': 'outro'},
+        ]}])
+        self.assertEqual(len(BitGroup.objects.get_group('homepage')), 3)
+
+        with self.assertRaises(ValidationError):
+            BitGroup.objects.bulk_provision([{'name': 'Homepage', 'bits': [
+                {'name': 'Header', 'context_name': 'header'},
+            ]}])
+
+        with self.assertRaises(ValidationError):
+            BitGroup.objects.bulk_provision([{'name': 'Sidebar', 'bits': [
+                {'name': 'Block', 'context_name': 'block'},
+                {'name': 'Block', 'context_name': 'block', 'type': 'video'},
+            ]}])
+        self.assertFalse(BitGroup.objects.filter(slug='sidebar').exists())
+
+    def test_raw_save(self):
+        """ Loading bits from a fixture leaves each with exactly one PageData """
+        bit = PageBit(
+            name='fixture',
+            context_name='fixture',
+            type=PageBit.PLAIN_TEXT,
+            group=self.group1
+        )
+        bit.save_base(raw=True)
+        self.assertEqual(PageData.objects.filter(bit=bit).count(), 1)
+
+        data = PageData(pk=PageData.objects.order_by('-pk')[0].pk + 100, bit=bit, data='Fixture')
+        data.save_base(raw=True)
+        self.assertEqual(list(PageData.objects.filter(bit=bit)), [data])
+
+    def tearDown(self):
+        cache.clear()
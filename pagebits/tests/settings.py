@@ -33,8 +33,12 @@ PREREQ_APPS = [
     'debug_toolbar',
     'django_coverage',
     'ckeditor',
+    'south',
 ]
 
+# Test databases are created with syncdb rather than the migrations
+SOUTH_TESTS_MIGRATE = False
+
 PROJECT_APPS = [
     'pagebits',
 ]
@@ -4,6 +4,7 @@ import shutil
 from django.core.files import File
 from django.core.cache import cache
 from django.conf import settings
+from django.template import Context, Template, TemplateSyntaxError
 from django.test import TestCase
 
 from ..models import BitGroup, PageBit
@@ -51,6 +52,56 @@ class PageBitTemplateTagTests(TestCase):
         self.assertEqual(bits['page_block'], self.bit2.data.data)
         self.assertEqual(bits['logo_image'], self.bit3.data.image)
 
+    def test_templatetag_multiple_groups(self):
+        group2 = BitGroup.objects.create(name='override')
+        bit = PageBit.objects.create(
+            name='header',
+            context_name='header',
+            type=0,
+            group=group2
+        )
+        bit.data.data = 'Override Header'
+        bit.data.save()
+
+        bits = pagebits('testgroup', 'override')
+        self.assertEqual(bits['header'], 'Override Header')
+        self.assertEqual(bits['page_block'], self.bit2.data.data)
+
+    def test_pagebits_cache(self):
+        t = Template(
+            "{% load pagebits %}"
+            "{% pagebits_cache 'testgroup' %}"
+            "{% pagebits 'testgroup' as bits %}{{ bits.header }} {{ counter }}"
+            "{% endpagebits_cache %}"
+        )
+
+        self.assertEqual(t.render(Context({'counter': 1})), 'Test Page Header 1')
+
+        # Cached until the group changes
+        self.assertEqual(t.render(Context({'counter': 2})), 'Test Page Header 1')
+
+        self.bit1.data.data = 'New Header'
+        self.bit1.data.save()
+        self.assertEqual(t.render(Context({'counter': 3})), 'New Header 3')
+
+    def test_pagebits_cache_vary_on(self):
+        t = Template(
+            "{% load pagebits %}"
+            "{% pagebits_cache 'testgroup' vary_on counter %}"
+            "{{ counter }}"
+            "{% endpagebits_cache %}"
+        )
+
+        self.assertEqual(t.render(Context({'counter': 1})), '1')
+        self.assertEqual(t.render(Context({'counter': 2})), '2')
+
+    def test_pagebits_cache_syntax(self):
+        with self.assertRaises(TemplateSyntaxError):
+            Template(
+                "{% load pagebits %}"
+                "{% pagebits_cache %}{% endpagebits_cache %}"
+            )
+
     def tearDown(self):
         """ Cleanup """
         cache.clear()
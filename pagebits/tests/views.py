@@ -1,12 +1,23 @@
 import os
 import shutil
+import tempfile
 
+from django.core.cache import cache
 from django.core.files import File
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
 from django.conf import settings
 from django.test import TestCase
+from django.test.utils import override_settings
 
+from ..managers import BitGroupManager
 from ..models import BitGroup, PageBit, PageTemplate, Page
+from ..templatetags.pagebits import template_group_slugs
+
+# Responses are stored once every other middleware has handled them
+RESPONSE_CACHE_MIDDLEWARE = (
+    'pagebits.middleware.PageBitsMiddleware',
+) + tuple(settings.MIDDLEWARE_CLASSES)
 
 
 class PageBitViewTests(TestCase):
@@ -81,5 +92,282 @@ class PageBitViewTests(TestCase):
         self.assertEqual(response.context['header'], self.bit1.data.data)
         self.assertEqual(response.context['page_block'], self.bit2.data.data)
 
+    def test_fallback_routing(self):
+        template = PageTemplate.objects.create(name='test', path='test.html')
+        page = Page.objects.create(
+            name='Test',
+            url='test4/test/',
+            template=template,
+        )
+        page.bit_groups.add(self.group)
+
+        self.assertEqual(
+            Page.objects.get_route('test4/test/'),
+            ('test.html', ['testgroup']),
+        )
+
+        # Warm pages and unknown urls are both answered without queries
+        self.client.get('/test4/test/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/test4/test/')
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/notest/nohere/')
+        self.assertEqual(response.status_code, 404)
+
+        # Changing the page's groups or template is picked up
+        group2 = BitGroup.objects.create(name='testgroup2')
+        page.bit_groups.add(group2)
+        self.assertEqual(
+            Page.objects.get_route('test4/test/'),
+            ('test.html', ['testgroup', 'testgroup2']),
+        )
+
+        template.path = '404.html'
+        template.save()
+        self.assertEqual(Page.objects.get_route('test4/test/')[0], '404.html')
+
+        page.delete()
+        self.assertEqual(Page.objects.get_route('test4/test/'), None)
+
+    def test_conditional_get(self):
+        response = self.client.get(reverse('testview'))
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+
+        response = self.client.get(reverse('testview'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(
+            reverse('testview'),
+            HTTP_IF_MODIFIED_SINCE=last_modified,
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # Any content change produces a new validator
+        self.bit1.data.data = 'Changed'
+        self.bit1.data.save()
+
+        response = self.client.get(reverse('testview'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(
+        PAGEBITS_RESPONSE_CACHE=True,
+        MIDDLEWARE_CLASSES=RESPONSE_CACHE_MIDDLEWARE,
+    )
+    def test_response_cache(self):
+        response = self.client.get(reverse('testview'))
+        self.assertEqual(len(response.templates), 1)
+        content = response.content
+
+        # Served without rendering the template
+        response = self.client.get(reverse('testview'))
+        self.assertEqual(response.templates, [])
+        self.assertEqual(response.content, content)
+
+        # Content edits change the key, no purge needed
+        self.bit1.data.data = 'Changed'
+        self.bit1.data.save()
+
+        response = self.client.get(reverse('testview'))
+        self.assertEqual(len(response.templates), 1)
+        self.assertTrue('Changed' in response.content)
+
+    @override_settings(
+        PAGEBITS_RESPONSE_CACHE=True,
+        MIDDLEWARE_CLASSES=(
+            'pagebits.middleware.PageBitsMiddleware',
+            'django.middleware.locale.LocaleMiddleware',
+        ),
+        LANGUAGES=(('en', 'English'), ('de', 'German')),
+    )
+    def test_response_cache_language(self):
+        # LocaleMiddleware varies on Accept-Language after the view has run
+        self.client.get(reverse('testview'), HTTP_ACCEPT_LANGUAGE='de')
+        response = self.client.get(reverse('testview'), HTTP_ACCEPT_LANGUAGE='de')
+        self.assertEqual(len(response.templates), 1)
+
+        with override_settings(PAGEBITS_RESPONSE_CACHE_VARY=('Accept-Language', )):
+            self.client.get(reverse('testview'), HTTP_ACCEPT_LANGUAGE='de')
+            response = self.client.get(reverse('testview'), HTTP_ACCEPT_LANGUAGE='de')
+            self.assertEqual(response.templates, [])
+
+            # Each language has its own entry
+            response = self.client.get(reverse('testview'), HTTP_ACCEPT_LANGUAGE='en')
+            self.assertEqual(len(response.templates), 1)
+
+    @override_settings(
+        PAGEBITS_RESPONSE_CACHE=True,
+        MIDDLEWARE_CLASSES=RESPONSE_CACHE_MIDDLEWARE,
+    )
+    def test_response_cache_template_change(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'changing.html')
+
+        template = PageTemplate.objects.create(name='test', path='changing.html')
+        page = Page.objects.create(
+            name='Test',
+            url='test9/test/',
+            template=template,
+        )
+        page.bit_groups.add(self.group)
+
+        try:
+            with override_settings(TEMPLATE_DIRS=(directory, )):
+                self.write_template(path, 'Old {{ header }}', 1000000000)
+                self.client.get('/test9/test/')
+                response = self.client.get('/test9/test/')
+                self.assertEqual(response.templates, [])
+
+                # A changed template is rendered again, no purge needed
+                self.write_template(path, 'New {{ header }}', 1000000100)
+                response = self.client.get('/test9/test/')
+                self.assertEqual(len(response.templates), 1)
+                self.assertTrue('New' in response.content)
+        finally:
+            shutil.rmtree(directory)
+
+    @override_settings(
+        PAGEBITS_RESPONSE_CACHE=True,
+        PAGEBITS_RESPONSE_CACHE_EXCLUDE=('test5/test/', ),
+        MIDDLEWARE_CLASSES=RESPONSE_CACHE_MIDDLEWARE,
+    )
+    def test_response_cache_exclude(self):
+        template = PageTemplate.objects.create(name='test', path='test.html')
+        page = Page.objects.create(
+            name='Test',
+            url='test5/test/',
+            template=template,
+        )
+        page.bit_groups.add(self.group)
+
+        self.client.get('/test5/test/')
+        response = self.client.get('/test5/test/')
+        self.assertEqual(len(response.templates), 1)
+
+    def test_snapshot(self):
+        template = PageTemplate.objects.create(name='test', path='test.html')
+        page = Page.objects.create(
+            name='Test',
+            url='test7/test/',
+            template=template,
+        )
+        page.bit_groups.add(self.group)
+
+        path = os.path.join(tempfile.mkdtemp(), 'pagebits.snapshot')
+        call_command('pagebits_snapshot', path, verbosity=0)
+        cache.clear()
+
+        try:
+            with override_settings(PAGEBITS_SNAPSHOT=path):
+                with self.assertNumQueries(0):
+                    response = self.client.get('/test7/test/')
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.context['header'], self.bit1.data.data)
+                    self.assertEqual(response.context['logo_image'], self.bit3.data.image)
+
+                    response = self.client.get('/notest/nohere/')
+                    self.assertEqual(response.status_code, 404)
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_template_group_slugs(self):
+        self.assertEqual(
+            template_group_slugs('prefetch.html'),
+            ['testgroup', 'othergroup', 'includegroup'],
+        )
+
+    def write_template(self, path, source, stamp):
+        with open(path, 'w') as f:
+            f.write(source)
+        os.utime(path, (stamp, stamp))
+
+    def test_template_group_slugs_cached(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'changing.html')
+        source = "{%% load pagebits %%}{%% pagebits '%s' as bits %%}"
+
+        try:
+            with override_settings(TEMPLATE_DIRS=(directory, )):
+                self.write_template(path, source % 'first', 1000000000)
+                self.assertEqual(template_group_slugs('changing.html'), ['first'])
+
+                # Kept as long as the file isn't modified
+                self.write_template(path, source % 'second', 1000000000)
+                self.assertEqual(template_group_slugs('changing.html'), ['first'])
+
+                self.write_template(path, source % 'second', 1000000100)
+                self.assertEqual(template_group_slugs('changing.html'), ['second'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_template_change_validators(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'changing.html')
+
+        template = PageTemplate.objects.create(name='test', path='changing.html')
+        page = Page.objects.create(
+            name='Test',
+            url='test8/test/',
+            template=template,
+        )
+        page.bit_groups.add(self.group)
+
+        try:
+            with override_settings(TEMPLATE_DIRS=(directory, )):
+                self.write_template(path, 'Old {{ header }}', 1000000000)
+                response = self.client.get('/test8/test/')
+                etag = response['ETag']
+                last_modified = response['Last-Modified']
+
+                # A deploy changes the template, but none of the content
+                self.write_template(path, 'New {{ header }}', 2000000000)
+
+                response = self.client.get('/test8/test/', HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+                response = self.client.get(
+                    '/test8/test/',
+                    HTTP_IF_MODIFIED_SINCE=last_modified,
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue('New' in response.content)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_template_prefetch(self):
+        BitGroup.objects.create(name='othergroup')
+        BitGroup.objects.create(name='includegroup')
+
+        template = PageTemplate.objects.create(name='test', path='prefetch.html')
+        page = Page.objects.create(
+            name='Test',
+            url='test6/test/',
+            template=template,
+        )
+        page.bit_groups.add(self.group)
+
+        calls = []
+        original = BitGroupManager._load_payloads
+
+        def load(manager, slugs):
+            calls.append(sorted(slugs))
+            return original(manager, slugs)
+
+        BitGroupManager._load_payloads = load
+        try:
+            response = self.client.get('/test6/test/')
+        finally:
+            BitGroupManager._load_payloads = original
+
+        # Everything the page and its templates need came in one batch
+        self.assertEqual(calls, [['includegroup', 'othergroup', 'testgroup']])
+        self.assertTrue(self.bit1.data.data in response.content)
+
     def tearDown(self):
+        cache.clear()
         shutil.rmtree(settings.MEDIA_ROOT)
@@ -1,9 +1,169 @@
+import hashlib
+
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import translation
+from django.utils.encoding import smart_str
+from django.utils.http import parse_etags, parse_http_date_safe
+
+try:
+    from importlib import import_module
+except ImportError:  # Python 2.6
+    from django.utils.importlib import import_module
+
+
+def setting(name, default=None):
+    """
+    Read ``PAGEBITS_<name>``, falling back to the ``PAGEBIT_<name>``
+    spelling earlier versions documented for the cache prefix and timeout
+    """
+    return getattr(settings, 'PAGEBITS_%s' % name,
+                   getattr(settings, 'PAGEBIT_%s' % name, default))
+
+
+def cache_timeout():
+    return int(setting('CACHE_TIMEOUT', 3600))
+
+
+def cache_prefix():
+    return setting('CACHE_PREFIX', 'pagebits')
+
+
+_key_functions = {}
+
 
+def key_function():
+    """
+    The callable named by ``PAGEBITS_CACHE_KEY_FUNCTION``, given every
+    pagebits cache key and returning the key to use instead, for example to
+    keep the content of each site apart
+    """
+    path = getattr(settings, 'PAGEBITS_CACHE_KEY_FUNCTION', None)
+    if path is None or callable(path):
+        return path
 
-def bitgroup_cache_key(slug):
-    return "%s:%s" % (
-        getattr(settings, 'PAGEBIT_CACHE_PREFIX', 'pagebits'),
+    if path not in _key_functions:
+        module, attr = path.rsplit('.', 1)
+        try:
+            _key_functions[path] = getattr(import_module(module), attr)
+        except (ImportError, AttributeError) as e:
+            raise ImproperlyConfigured("Error loading cache key function %s: %s" % (path, e))
+
+    return _key_functions[path]
+
+
+def make_key(key):
+    func = key_function()
+    return func(key) if func is not None else key
+
+
+def bitgroup_cache_key(slug, version=None):
+    key = "%s:%s" % (
+        cache_prefix(),
         slug
     )
 
+    if version is not None:
+        key = "%s:%s" % (key, version)
+
+    return make_key(key)
+
+
+def bitgroup_version_key(slug):
+    """ Key holding the current version of a BitGroup's cached content """
+    return make_key("%s-version:%s" % (
+        cache_prefix(),
+        slug
+    ))
+
+
+def manifest_cache_key(slug, version):
+    """ Key of the list of bit keys a BitGroup version is made up of """
+    return make_key("%s-manifest:%s:%s" % (
+        cache_prefix(),
+        slug,
+        version
+    ))
+
+
+def bit_cache_key(bit_id, version):
+    """ Key of a single packed PageBit, used with ``PAGEBITS_BIT_CACHE`` """
+    return make_key("%s-bit:%s:%s" % (
+        cache_prefix(),
+        bit_id,
+        version
+    ))
+
+
+def generation_cache_key():
+    """ Key of the global content generation, bumped on every content change """
+    return make_key("%s-generation" % cache_prefix())
+
+
+def routes_cache_key(version):
+    """ Key of the cached url to template and group slugs table for Pages """
+    return make_key("%s-routes:%s" % (
+        cache_prefix(),
+        version
+    ))
+
+
+def routes_version_key():
+    return make_key("%s-routes-version" % cache_prefix())
+
+
+def response_cache_key(request, etag, fingerprint, vary_headers):
+    """
+    Key of a cached rendered response, the etag covers the group versions
+    and the template's source fingerprint is added, so neither content
+    edits nor template changes need an explicit purge
+    """
+    parts = [
+        request.get_full_path(),
+        translation.get_language() or '',
+        etag,
+        fingerprint,
+    ]
+    parts.extend(
+        request.META.get('HTTP_%s' % header.upper().replace('-', '_'), '')
+        for header in vary_headers
+    )
+
+    return make_key("%s-response:%s" % (
+        cache_prefix(),
+        hashlib.md5(smart_str("|".join(parts))).hexdigest(),
+    ))
+
+
+def fragment_cache_key(fragment, versions, vary_on):
+    """ Key of a template fragment cached by the pagebits_cache tag """
+    parts = [fragment]
+    parts.extend(versions)
+    parts.extend(smart_str(value) for value in vary_on)
+
+    return make_key("%s-fragment:%s" % (
+        cache_prefix(),
+        hashlib.md5(smart_str("|".join(parts))).hexdigest(),
+    ))
+
+
+def not_modified(request, etag, last_modified):
+    """
+    Whether a conditional GET or HEAD request already has the current
+    content, If-None-Match takes precedence over If-Modified-Since
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag in etags or '*' in etags
+
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and last_modified is not None:
+        if_modified_since = parse_http_date_safe(if_modified_since)
+        return if_modified_since is not None and last_modified <= if_modified_since
+
+    return False
+
@@ -1,15 +1,59 @@
+import hashlib
+
+from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404, HttpResponse, HttpResponseNotModified
 from django.shortcuts import get_object_or_404
+from django.template.loader import get_template
 from django.template.response import TemplateResponse
+from django.utils.cache import cc_delim_re, patch_vary_headers
+from django.utils.encoding import smart_str
+from django.utils.http import http_date, quote_etag
 from django.views.generic import TemplateView
 
+from .cache import cache
+from .managers import request_store
 from .models import BitGroup, Page
+from .payload import GroupBits
+from .templatetags.pagebits import analyze_template, template_group_slugs
+from .utils import cache_timeout, not_modified, response_cache_key
+
+
+class BitsContext(dict):
+    """
+    Context dict which also offers every bit of a GroupBits, only resolving
+    the ones the template actually uses.  Bits win over other context
+    variables of the same name.
+    """
+    __slots__ = ('bits', )
+
+    def __init__(self, context, bits):
+        super(BitsContext, self).__init__(context)
+        self.bits = bits
+
+    def __getitem__(self, key):
+        if key in self.bits:
+            return self.bits[key]
+        return super(BitsContext, self).__getitem__(key)
+
+    def __contains__(self, key):
+        return key in self.bits or super(BitsContext, self).__contains__(key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
 
 
 class PageBitView(TemplateView):
     """
     Template view that adds PageBits to the Context
     """
+    # None follows the PAGEBITS_RESPONSE_CACHE setting
+    cache_response = None
+
+    # Literal group slugs used by the template's own tags
+    template_slugs = ()
 
     def get_template_name(self):
         if self.template_name:
@@ -22,21 +66,127 @@ class PageBitView(TemplateView):
         else:
             return [self.template_name]
 
+    def get_bit_groups(self):
+        """ The GroupBits of every group in this view, loaded once """
+        if getattr(self, 'bit_groups', None) is None:
+            self.bit_groups = BitGroup.objects.get_groups(self.group_slugs)
+        return self.bit_groups
+
     def get_context_data(self, **kwargs):
         context = super(PageBitView, self).get_context_data(**kwargs)
-        new_context = {}
 
-        for slug in self.group_slugs:
-            group = BitGroup.objects.get_group(slug=slug)
+        # Groups are returned in the order of our slugs, so bits in later
+        # groups override bits with the same context name in earlier ones.
+        return BitsContext(context, GroupBits.merge(self.get_bit_groups()))
+
+    def get_validators(self, template_name):
+        """
+        Return the ETag and Last-Modified timestamp of the page, built from
+        the cached versions and modification times of its groups, including
+        those its template asks for, and of the template itself
+        """
+        groups = BitGroup.objects.get_groups(
+            list(self.group_slugs) + list(self.template_slugs)
+        )
+        analysis = analyze_template(template_name)
+
+        etag = hashlib.md5(smart_str("%s|%s|%s" % (
+            template_name,
+            analysis.fingerprint,
+            "|".join("%s:%s" % (bits.slug, bits.version) for bits in groups),
+        ))).hexdigest()
+
+        modified = [bits.modified for bits in groups if bits.modified is not None]
+        if analysis.modified is not None:
+            modified.append(analysis.modified)
+        last_modified = max(modified) if modified else None
+
+        return etag, last_modified
+
+    def render_bits(self, request, template_name, **kwargs):
+        """
+        Render template_name with our bits, unless the client's conditional
+        GET shows it already has them.
+
+        The groups of the view and every group its template asks for with a
+        literal slug are loaded in a single batch before anything renders,
+        and memoized for the template tags.
+        """
+        template = get_template(template_name)
+        self.template_slugs = template_group_slugs(template_name)
+
+        # Without PageBitsMiddleware we keep a request store of our own, open
+        # until the template has been rendered
+        owns_store = request_store.groups is None
+        if owns_store:
+            request_store.begin()
+
+        try:
+            response = self.build_response(request, template, template_name, **kwargs)
+        except Exception:
+            if owns_store:
+                request_store.end()
+            raise
+
+        if owns_store:
+            if getattr(response, 'is_rendered', True):
+                request_store.end()
+            else:
+                response.add_post_render_callback(lambda r: request_store.end())
+
+        return response
+
+    def build_response(self, request, template, template_name, **kwargs):
+        etag, last_modified = self.get_validators(template_name)
+
+        if not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+        elif self.should_cache_response():
+            response = self.render_cached(request, template, etag, **kwargs)
+        else:
+            context = self.get_context_data(**kwargs)
+            response = TemplateResponse(request, template, context)
+
+        response['ETag'] = quote_etag(etag)
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+
+        return response
+
+    def should_cache_response(self):
+        cache_response = self.kwargs.get('cache_response', self.cache_response)
+
+        if cache_response is None:
+            cache_response = getattr(settings, 'PAGEBITS_RESPONSE_CACHE', False)
+
+        return cache_response
+
+    def render_cached(self, request, template, etag, **kwargs):
+        """
+        Serve the rendered page from the cache, or render it and mark it for
+        PageBitsMiddleware to store.  Keys include the validator, so edits
+        change the key.
+        """
+        vary_headers = getattr(settings, 'PAGEBITS_RESPONSE_CACHE_VARY', ())
+        fingerprint = analyze_template(template.name).fingerprint
+        key = response_cache_key(request, etag, fingerprint, vary_headers)
+        cached = cache.get(key)
 
-            # Ensure we don't have slug/context name conflicts inside a single
-            # view, which could happen if you define two slugs with the same
-            # bit slugs.
-            for bit in group.bits.all():
-                new_context[bit.context_name] = bit.resolve()
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            context = self.get_context_data(**kwargs)
+            response = TemplateResponse(request, template, context)
+
+            # Stored by PageBitsMiddleware, once other middleware has had its
+            # say about cookies and the Vary header
+            response._pagebits_cache = (key, vary_headers)
+
+        if vary_headers:
+            patch_vary_headers(response, vary_headers)
 
-        context.update(new_context)
-        return context
+        return response
 
     def get(self, request, *args, **kwargs):
         self.group_slugs = self.kwargs.pop('groups', None)
@@ -48,8 +198,40 @@ class PageBitView(TemplateView):
             )
 
         self.get_template_name()
-        context = self.get_context_data(**kwargs)
-        return TemplateResponse(request, self.template_name, context)
+        kwargs.pop('template_name', None)
+        return self.render_bits(request, self.template_name, **kwargs)
+
+
+def store_response(request, response):
+    """ Cache a response render_cached() marked for it, when cacheable """
+    key, vary_headers = getattr(response, '_pagebits_cache', (None, None))
+
+    if key is not None and cacheable(request, response, vary_headers):
+        cache.set(key, (response.content, response['Content-Type']), cache_timeout())
+
+
+def cacheable(request, response, vary_headers):
+    """
+    Whether a rendered response is the same for everybody, apart from the
+    headers we vary on
+    """
+    if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+        return False
+
+    # Anything touching cookies, the session or a CSRF token is per-user
+    if response.cookies or request.META.get('CSRF_COOKIE_USED'):
+        return False
+
+    session = getattr(request, 'session', None)
+    if session is not None and session.accessed:
+        return False
+
+    allowed = set(header.lower() for header in vary_headers)
+    varies = set()
+    if response.has_header('Vary'):
+        varies = set(header.lower() for header in cc_delim_re.split(response['Vary']))
+
+    return varies <= allowed
 
 
 class PageView(PageBitView):
@@ -58,12 +240,30 @@ class PageView(PageBitView):
     """
     url = None
 
+    @property
+    def page(self):
+        """ The Page being displayed, only queried for when used """
+        if not hasattr(self, '_page'):
+            self._page = get_object_or_404(Page, url=self.url)
+        return self._page
+
+    def should_cache_response(self):
+        excluded = getattr(settings, 'PAGEBITS_RESPONSE_CACHE_EXCLUDE', ())
+
+        if self.url in excluded:
+            return False
+
+        return super(PageView, self).should_cache_response()
+
     def get(self, request, *args, **kwargs):
         self.url = self.kwargs.pop('url', self.url)
-        self.page = get_object_or_404(Page, url=self.url)
 
-        self.group_slugs = [x.slug for x in self.page.bit_groups.all()]
-        context = self.get_context_data(**kwargs)
+        # Served from the cached routing table, so neither pages nor unknown
+        # urls cost any queries
+        route = Page.objects.get_route(self.url)
+        if route is None:
+            raise Http404
 
-        return TemplateResponse(request, self.page.template.path, context)
+        template_path, self.group_slugs = route
+        return self.render_bits(request, template_path, **kwargs)
 
@@ -23,7 +23,11 @@ setup(
         'PIL >= 1.1.7',
         'Pillow >= 1.7.7',
     ],
+    extras_require={
+        'migrations': ['South >= 0.7.6'],
+    },
     tests_require=[
+        'South',
         'django-debug-toolbar',
         'django-coverage',
         'coverage',